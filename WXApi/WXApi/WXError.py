@@ -40,7 +40,7 @@ class WeChatError(Exception):
     """
 
     def __init__(self, wx_json):
-        super(WeChatError, self).__init__(self)
+        super(WeChatError, self).__init__(wx_json)
         try:
             self.errorCode = wx_json["errcode"]
             self.errorEnMsg = wx_json["errmsg"]
@@ -50,8 +50,21 @@ class WeChatError(Exception):
             logging.error(wx_json)
             raise WXApiError("微信服务器返回的结果不是JSON")
 
+    @property
+    def message(self):
+        return self.errorEnMsg
+
     def is_access_token_expires(self):
-        return self.errorCode == 40001
+        return self.errorCode in (40001, 40014, 42001)
+
+    def is_system_busy(self):
+        return self.errorCode == -1
+
+    def is_rate_limited(self):
+        return self.errorCode in (45009, 45011)
+
+    def is_invalid_media(self):
+        return self.errorCode == 40007
 
     def is_permission_denied(self):
         return self.errorCode == 48001
@@ -145,6 +158,7 @@ _WXErrCNMsg = {
     45008: "图文消息超过限制",
     45009: "接口调用超过限制",
     45010: "创建菜单个数超过限制",
+    45011: "API调用太频繁，请稍候再试",
     45015: "回复时间超过限制",
     45016: "系统分组，不允许修改",
     45017: "分组名字过长",
@@ -6,63 +6,161 @@ from __future__ import unicode_literals
 2014/5/23将格式转换全部放置在本模块
 Create:2014/5/21
 """
+import multiprocessing
+import os
+import re
 import sys
+import tempfile
+import threading
 import traceback
 import logging
+from collections import OrderedDict
+from itertools import islice
 from hashlib import sha1 as _sha1
 from binascii import unhexlify as _unhexs
 from xml.etree.ElementTree import fromstring
 
 from .event import *
+from .event import _EVENT_TYPES
 from .WXError import *
 
 if sys.version_info.major == 2:
     from urllib import (quote, unquote, urlencode as url_encode)
 if sys.version_info.major == 3:
     from urllib.parse import (quote, unquote, urlencode as url_encode)
+try:
+    from hmac import compare_digest as _compare_digest
+except ImportError:  # Python < 2.7.7
+    def _compare_digest(a, b):
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(bytearray(a), bytearray(b)):
+            result |= x ^ y
+        return result == 0
+
+_replace = getattr(os, 'replace', os.rename)  # Python 2 没有 os.replace
 
-__all__ = ['url_decode', 'url_encode', 'quote', 'unquote', 'auth_signature', 'xml2event']
+__all__ = ['url_decode', 'parse_callback_query', 'url_encode', 'quote', 'unquote', 'auth_signature',
+           'SignatureVerifier', 'xml2event', 'xml2events', 'FailedRecord']
 
 
 def url_decode(query, encoding="utf-8"):
-    """`url_encode` 的反操作, 正确与否均返回dict,若不会符合则返回空的`dict`"""
+    """`url_encode` 的反操作, 正确与否均返回dict, 没有 '=' 的部分忽略; 无法解码时返回空的`dict`"""
     try:
+        if isinstance(query, bytes):
+            query = query.decode(encoding)
         result = dict()
-        parts = query.decode(encoding).split('&')
-        for part in parts:
-            if part.find('='):
-                k, v = map(unquote, part.split('='))
-                result.update({k: v})
+        for part in query.split('&'):
+            if '=' in part:
+                k, _, v = part.partition('=')
+                result[unquote(k)] = unquote(v)
         return result
-    except Exception as e:
-        traceback.print_exc()
-        logging.error("`url_decode` error:: request is {query}".format(query=query))
-        logging.error("处理微信请求认证时出错:::{err}".format(err=e))
+    except UnicodeDecodeError as e:
+        logging.debug("`url_decode` 无法解码请求参数:::%s", e)
         return dict()
 
 
+# 处理微信回调时需要的 URL 参数
+_CALLBACK_FIELDS = frozenset(['signature', 'timestamp', 'nonce', 'echostr', 'msg_signature', 'encrypt_type'])
+
+
+def parse_callback_query(query, encoding="utf-8"):
+    # type: (bytes, str) -> dict
+    """
+    只取出微信回调需要的参数(signature, timestamp, nonce, echostr, msg_signature, encrypt_type), 用于代替 `url_decode`
+    只对含 '%' 的值调用 `unquote`, 格式错误的部分直接跳过, 无法解码时返回空的`dict`
+    """
+    if isinstance(query, bytes):
+        try:
+            query = query.decode(encoding)
+        except UnicodeDecodeError:
+            return dict()
+    result = dict()
+    for part in query.split('&'):
+        key, sep, value = part.partition('=')
+        if sep and key in _CALLBACK_FIELDS:
+            result[key] = unquote(value) if '%' in value else value
+    return result
+
+
 def auth_signature(auth_token, args, encoding="utf-8"):
     # type: (str, dict) -> bool
     """timestamp, nonce [echostr] 正确返回 True;错误/失败返回 False"""
-    try:
-        sign_parm = [auth_token]
-        for i in ('timestamp', 'nonce'):
-            sign_parm.append(args[i])
+    return SignatureVerifier(auth_token, encoding).verify(args)
+
+
+class SignatureVerifier(object):
+    """
+    绑定 Token 的微信请求签名校验, 创建一次后每个请求复用
+    签名以常量时间比较, 参数格式错误直接返回 False 不打印堆栈
+    :param replay_cache_size: 大于 0 时记录最近通过校验的 (timestamp, nonce), 再次出现视为重放请求返回 False
+    """
+
+    def __init__(self, auth_token, encoding="utf-8", replay_cache_size=0):
+        self.encoding = encoding
+        self.token = auth_token.encode(encoding)
+        self.replay_cache_size = replay_cache_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, args):
+        # type: (dict) -> bool
+        """timestamp, nonce [echostr] 正确返回 True;错误/失败/重放返回 False"""
+        try:
+            timestamp = args['timestamp']
+            nonce = args['nonce']
+            sign_parm = [self.token, timestamp.encode(self.encoding), nonce.encode(self.encoding)]
+            client_sign = _unhexs(args['signature'])
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            logging.debug("验证失败!参数格式不符合要求:::%s", e)
+            return False
         sign_parm.sort()
-        client_sign = _unhexs(args['signature'])
-        server_sign = _sha1(''.join(sign_parm).encode(encoding)).digest()
-        if client_sign == server_sign:
-            return True
-        else:
+        if not _compare_digest(_sha1(b''.join(sign_parm)).digest(), client_sign):
             return False
-    except (KeyError, TypeError, AttributeError) as e:
-        traceback.print_exc()
-        logging.warn("验证失败!参数格式不符合要求:[{args}]:::{error}".format(args=args, error=e))
-        return False
+        if self.replay_cache_size > 0:
+            return self._remember(timestamp, nonce)
+        return True
+
+    __call__ = verify
+
+    def _remember(self, timestamp, nonce):
+        """首次出现返回 True 并记录, 超出容量时淘汰最早的记录"""
+        key = (timestamp, nonce)
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen[key] = None
+            if len(self._seen) > self.replay_cache_size:
+                self._seen.popitem(last=False)
+        return True
+
+
+# 微信推送的消息/事件均为单层 `<xml>` 报文, 节点值为纯文本或单个 CDATA
+_FLAT_XML_NODE = re.compile(r'\s*<([A-Za-z_][\w.\-]*)>'
+                            r'(?:<!\[CDATA\[([^\]]*(?:\](?!\]>)[^\]]*)*)\]\]>|([^<&]*))</\1>')
+
+
+def _flat_xml2json(xml_data, encoding="utf-8"):
+    # type: (bytes, str) -> dict
+    """单层 `<xml>` 报文的快速解析, 不构建 ElementTree; 遇到不符合的格式返回 `None` 交由 `fromstring` 处理"""
+    if not isinstance(xml_data, bytes) or b'\r' in xml_data:  # 换行需按XML规范归一化
+        return None
+    try:
+        # [前导, tag, cdata, text, 间隔, tag, cdata, text, ..., 结尾]
+        parts = _FLAT_XML_NODE.split(xml_data.decode(encoding))
+    except UnicodeDecodeError:
+        return None
+    if parts[0].strip() != '<xml>' or parts[-1].strip() != '</xml>' or any(parts[4:-1:4]):
+        return None
+    return dict((tag, cdata or text or None) for tag, cdata, text in zip(parts[1::4], parts[2::4], parts[3::4]))
 
 
 def xml2json(xml_data, encoding="utf-8"):
     # type: (str, str) -> dict
+    result = _flat_xml2json(xml_data)
+    if result is not None:
+        return result
     result = dict()
     _add = result.update
     try:
@@ -77,50 +175,115 @@ def xml2json(xml_data, encoding="utf-8"):
         raise WXApiError("请求方提供的XML数据格式不正确")
 
 
-def xml2event(xml_data, encoding="utf-8"):
-    # type:(bytes, str)-> dict
-    """入参需要是utf8编码,将xml转换为 dict,出错抛出 WXError"""
+def xml2event(xml_data, encoding="utf-8", lazy=False):
+    # type:(bytes, str, bool)-> WeChatObject
+    """入参需要是utf8编码,将xml转换为 dict,出错抛出 WXError
+    `lazy` 为真时除 from_id/to_id/time 外的字段在首次访问时才解析, 字段缺失等错误也推迟到那时以 AttributeError 抛出"""
     result = xml2json(xml_data, encoding)
 
-    msg_type = result.get('MsgType')
+    event_class = _event_class(result)
+    if event_class is not None:
+        return event_class.lazy(result) if lazy else event_class(result)
     if 'MsgId' in result:  # 消息
-        if 'text' == msg_type:
-            return TextMsg(result)
-        elif 'image' == msg_type:
-            return ImageMsg(result)
-        elif 'voice' == msg_type:
-            return VoiceMsg(result)
-        elif 'video' == msg_type:
-            return VideoMsg(result)
-        elif 'link' == msg_type:
-            return LinkMsg(result)
-        elif 'location' == msg_type:
-            return LocationMsg(result)
-        else:
-            logging.warn("未知的消息类型:[%s]" % xml_data.decode('utf8'))
-            raise WXApiError("UnKnown Message Type")
-    else:  # 事件或新增其他
-        event = result.get('Event')
-        if 'event' == msg_type:
-            if 'location' == event:  #
-                return LocationEvent(result)
-            if 'subscribe' == event:
-                return SubEvent(result)
-            elif 'unsubscribe' == event:
-                # logging.info("取消订阅")
-                return UnSubEvent(result)
-            elif 'scan' == event:  # 二维码扫描
-                # logging.info("用户二维码扫描")
-                return ScanEvent(result)
-            elif 'click' == event:  # 自定义菜单
-                # logging.info("用户点击菜单按键")
-                return ClickEvent(result)
-            elif 'view' == event:  # 跳转到预设的地址
-                # logging.info("用户点击菜单链接")
-                return ViewEvent(result)
-            else:
-                # logging.warn("未知的事件类型:[%s]" % xml_data.decode('utf8'))
-                raise WXApiError("UnSupport Event Type")
-        else:
-            # logging.warn("未知的新增类型:[%s]" % xml_data.decode('utf8'))
-            raise WXApiError("UnKnown Message Type or Event")
+        logging.warn("未知的消息类型:[%s]" % xml_data.decode('utf8'))
+        raise WXApiError("UnKnown Message Type")
+    elif 'event' == result.get('MsgType'):  # 事件
+        raise WXApiError("UnSupport Event Type")
+    else:
+        raise WXApiError("UnKnown Message Type or Event")
+
+
+def _event_class(result):
+    # type: (dict) -> type
+    """按 (MsgType, Event) 查找已注册的类, 未注册返回 None; 没有 MsgId 的报文只按事件查找"""
+    if 'MsgId' in result:
+        return _EVENT_TYPES.get((result.get('MsgType'), None))
+    event = result.get('Event')
+    if not event:
+        return None
+    return _EVENT_TYPES.get((result.get('MsgType'), event.lower()))
+
+
+class FailedRecord(object):
+    """`xml2events` 中无法转换的记录: 在输入中的序号, 原始数据及原因"""
+
+    def __init__(self, index, data, reason):
+        self.index = index
+        self.data = data
+        self.reason = reason
+
+    def __repr__(self):
+        return "FailedRecord({0}, {1!r})".format(self.index, self.reason)
+
+
+def _bulk_xml2event(record):
+    # type: (tuple) -> object
+    """`xml2events` 的单条转换, 出错时返回 `FailedRecord` 而不记录日志/堆栈"""
+    index, xml_data, lazy = record
+    try:
+        result = _flat_xml2json(xml_data)
+        if result is None:
+            result = dict((node.tag, node.text) for node in fromstring(xml_data))
+        event_class = _event_class(result)
+        if event_class is None:
+            return FailedRecord(index, xml_data, "UnKnown Message Type or Event")
+        return event_class.lazy(result) if lazy else event_class(result)
+    except Exception as e:
+        return FailedRecord(index, xml_data, "{0}: {1}".format(type(e).__name__, e))
+
+
+def xml2events(payloads, lazy=False, processes=None, chunksize=256):
+    """
+    批量转换归档的推送数据, 按输入顺序逐条产出事件对象或 `FailedRecord`
+    :param payloads: 可迭代的 bytes, 按需读取
+    :param lazy: 同 `xml2event`
+    :param processes: 指定时使用该数量的子进程并行解析; 自定义的事件类需在子进程中同样注册(fork 方式启动时自动继承)
+    :param chunksize: 每次派发给子进程的记录数
+    """
+    records = ((index, xml_data, lazy) for index, xml_data in enumerate(payloads))
+    if not processes:
+        for record in records:
+            yield _bulk_xml2event(record)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        window = processes * chunksize * 4  # 限制已读入但未产出的记录数
+        while True:
+            batch = list(islice(records, window))
+            if not batch:
+                break
+            for item in pool.imap(_bulk_xml2event, batch, chunksize):
+                yield item
+        pool.close()
+    finally:
+        pool.terminate()
+
+
+def _default_file_mode():
+    """新建文件的默认权限(0666 去掉 umask)"""
+    umask = os.umask(0)  # umask 只能通过设置来读取
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _atomic_write(path, write, discard=None):
+    # type: (str, callable, callable) -> object
+    """
+    原子地写入文件 `path`, 返回 `write(f)` 的返回值:
+    以 `write` 写入同目录下的临时文件, 完成后改为新建文件的默认权限(mkstemp 创建的为 0600)并替换 `path`
+    出错或 `discard(返回值)` 为真时删除临时文件, `path` 保持不变
+    """
+    path = os.path.abspath(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path), suffix='.part', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            result = write(f)
+        if discard is not None and discard(result):
+            os.remove(tmp_path)
+            return result
+        os.chmod(tmp_path, _default_file_mode())
+        _replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return result
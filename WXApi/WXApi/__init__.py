@@ -9,7 +9,20 @@ from .WXError import *
 from .WXMenu import *
 from .WXUtils import *
 from .event import *
+from .cache import *
+from .media_cache import *
+from .dedup import *
+from .crypto import *
+from .deferred import *
+from .webhook import *
 from .request import MPCenter
+from .token_store import *
+
+try:
+    from .async_request import AsyncMPCenter
+    from .async_webhook import ASGIWebhookApp
+except (ImportError, SyntaxError):  # 需要 Python 3.5+ 及 aiohttp
+    pass
 
 __date__ = '2017/3/12'
 __version__ = '1.0.1'
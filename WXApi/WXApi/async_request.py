@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+"""
+`MPCenter` 的 asyncio 版本, 基于 aiohttp 的连接池
+需要 Python 3.5+ 及 aiohttp: pip install pyweipi[async]
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from json import dumps
+from time import time
+
+import aiohttp
+
+from .WXError import *
+from .request import (_check_result, _check_media_file, _qrcode_params, _qrcode_url, _reply_json)
+
+__all__ = ['AsyncMPCenter']
+
+
+class AsyncMPCenter(object):
+    """
+    微信公众号后台接口(asyncio), 接口与 `MPCenter` 一致, 均为协程
+    access_token 通过 `await get_access_token()` 获取
+    用完后 `await close()` 或以 `async with` 语句管理
+    :param session: 外部提供的 `aiohttp.ClientSession`, 此时由调用方负责关闭
+    :param pool_size: 连接池最大连接数
+    :param keep_alive: 为 False 时每次请求后关闭连接
+    :param timeout: 请求超时秒数, 数值为总超时, 二元组为(连接, 读取)超时
+    """
+
+    def __init__(self, app_id, app_secret, enable_token_cache=True, token=None, expires=None,
+                 session=None, pool_size=10, keep_alive=True, timeout=(5, 30)):
+        super(AsyncMPCenter, self).__init__()
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.enable_cache = enable_token_cache
+        self.access_token_cache = token
+        if expires is None:
+            self.access_token_date = None
+        else:
+            self.access_token_date = datetime.fromtimestamp(expires)
+        if isinstance(timeout, tuple):
+            self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        else:
+            self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self._own_session = session is None
+        self.session = session
+        self._token_lock = None
+
+    def _get_session(self):
+        # aiohttp 要求在事件循环中创建会话, 故延迟到第一次请求
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, force_close=not self.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        """关闭自行创建的连接池"""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def get(self, url, **kwargs):
+        params = dict(kwargs)
+        params.update(dict(access_token=await self.get_access_token()))
+        async with self._get_session().get(url, params=params) as res_obj:
+            return await self.valid_response(res_obj)
+
+    async def post(self, url, data=None, json=None, params=None, **kwargs):
+        params = dict(params or {}, access_token=await self.get_access_token())
+        if data is None and json is not None:
+            data = dumps(json, ensure_ascii=False).encode('utf-8')
+        async with self._get_session().post(url, data=data, params=params, **kwargs) as res_obj:
+            return await self.valid_response(res_obj)
+
+    async def download(self, url, params=None, **kwargs):
+        """下载文件内容(bytes); 微信返回 JSON 时抛出 `WeChatError`, 没有 errcode 的 JSON(如视频的 video_url)以 dict 返回"""
+        async with self._get_session().get(url, params=params, **kwargs) as stream:
+            if stream.status < 400:
+                if stream.headers.get('Content-Type', '').startswith(('application/json', 'text/plain')):
+                    return await self.valid_response(stream)
+                return await stream.read()
+        raise WXApiError(url)
+
+    def update(self, app_id, app_secret):
+        self.app_id = app_id or self.app_id
+        self.app_secret = app_secret
+
+    async def refresh_access_token(self):
+        url = "https://api.weixin.qq.com/cgi-bin/token"
+        params = dict(
+            grant_type='client_credential',
+            appid=self.app_id,
+            secret=self.app_secret
+        )
+        async with self._get_session().get(url, params=params) as res_obj:
+            rs = await res_obj.json(content_type=None)
+        expires_in = int(rs['expires_in'])
+        self.access_token_cache = rs['access_token']
+        self.access_token_date = datetime.fromtimestamp(expires_in + time() - 60)
+        logging.warning("刷新access_token {0} 将于{1}过期".format(self.access_token_cache, self.access_token_date))
+        return dict(rs)
+
+    def _cached_token(self):
+        if self.enable_cache and self.access_token_cache is not None \
+                and self.access_token_date > datetime.now():
+            return self.access_token_cache
+        return None
+
+    async def get_access_token(self):
+        token = self._cached_token()
+        if token is not None:
+            return token
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:  # 只有一个协程刷新, 其余等待结果
+            token = self._cached_token()
+            if token is None:
+                await self.refresh_access_token()
+                token = self.access_token_cache
+        return token
+
+    async def valid_response(self, res_obj):
+        # type: (aiohttp.ClientResponse) -> dict
+        if res_obj.status < 400:
+            return _check_result(await res_obj.json(content_type=None))
+        raise WXApiError("微信服务器返回异常状态:%d" % res_obj.status)
+
+    async def reply(self, mp_reply):
+        """此接口主要用于客服等有人工消息处理环节的功能,时限48小时"""
+        url = 'https://api.weixin.qq.com/cgi-bin/message/custom/send'
+        try:
+            await self.post(url, json=_reply_json(mp_reply))
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        except Exception as e:
+            logging.error("客服消息回复失败")
+            raise WXApiError(e)
+        else:
+            return True
+
+    async def add_kf(self, account, nickname, password):
+        """增加客服账号"""
+        url = 'https://api.weixin.qq.com/customservice/kfaccount/add'
+        params = {
+            "kf_account": account,
+            "nickname": nickname,
+            "password": password,
+        }
+        try:
+            await self.post(url, json=params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            return True
+
+    async def broadcast(self):
+        """该接口不适用,服务号每月最大4次"""
+        pass
+
+    #######################
+    # 菜单界面管理
+    #######################
+    async def add_menu(self, wx_ui):
+        """请求微信服务器增加菜单, 成功返回 True"""
+        url = 'https://api.weixin.qq.com/cgi-bin/menu/create'
+        try:
+            await self.post(url, json=wx_ui)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+            return False
+        else:
+            logging.info('添加菜单成功')
+            return True
+
+    async def get_menu(self):
+        """请求微信服务器，获取当前有效的菜单格式"""
+        url = 'https://api.weixin.qq.com/cgi-bin/menu/get'
+        try:
+            res_obj = await self.get(url)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            return res_obj
+
+    async def del_menu(self):
+        """请求微信服务器，清空菜单"""
+        url = 'https://api.weixin.qq.com/cgi-bin/menu/delete'
+        try:
+            await self.get(url)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            logging.info("成功删除菜单")
+
+    #########################
+    # 组管理
+    #########################
+    async def create_group(self, group_name):
+        """新建组名称30字符内，返回(组名(str),微信分配的组Id(int))"""
+        url = 'https://api.weixin.qq.com/cgi-bin/groups/create'
+        params = {
+            "group": {
+                "name": group_name
+            }
+        }
+        try:
+            res_obj = await self.post(url, json=params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            gid = res_obj['group']['id']
+            logging.info('createGroups成功[group_id:%d,group_name:%s]' % (gid, group_name))
+            return group_name, gid
+
+    async def update_group(self, gid, group_name):
+        """更改已建的组名称30字符内"""
+        url = 'https://api.weixin.qq.com/cgi-bin/groups/update'
+        params = {
+            "group": {
+                "id": gid,
+                "name": group_name
+            }
+        }
+        try:
+            await self.post(url, json=params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+            return False
+        else:
+            logging.info('updateGroups成功[gid:%d,Gname:%s]' % (gid, group_name))
+            return True
+
+    async def get_groups(self):
+        """获取以创建的所有分组,成功[{name:, id:, users:)},...]"""
+        url = 'https://api.weixin.qq.com/cgi-bin/groups/get'
+        try:
+            res_obj = await self.get(url)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            logging.info('getGroups成功')
+            return [_group for _group in res_obj['groups']]
+
+    ##########################
+    # 用户管理
+    ##########################
+    async def update_user_gid(self, openid, gid):
+        """传入 用户的openid和目的组id"""
+        url = 'https://api.weixin.qq.com/cgi-bin/groups/members/update'
+        params = {
+            "openid": openid,
+            "to_groupid": gid
+        }
+        try:
+            await self.post(url, json=params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            logging.info('`update_user_gid` 更改用户组成功')
+
+    async def get_user_gid(self, openid):
+        """获取指定用户的组ID"""
+        url = 'https://api.weixin.qq.com/cgi-bin/groups/getid'
+        params = dict(openid=openid)
+        try:
+            res_obj = await self.post(url, json=params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            logging.info('`get_user_gid` 获取用户组ID成功')
+            return res_obj
+
+    async def get_user_info(self, openid, language='zh_CN'):
+        """获取用户个人信息"""
+        params = dict(openid=openid, lang=language)
+        url = 'https://api.weixin.qq.com/cgi-bin/user/info'
+        try:
+            res_obj = await self.get(url, **params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            logging.info('`get_user_info` 获取用户信息成功')
+            return res_obj
+
+    async def get_users(self):
+        """获取所有关注者的openid"""
+        all_users = list()
+        url = 'https://api.weixin.qq.com/cgi-bin/user/get'
+        logging.info('获取所有用户')
+        res_obj = await self.get(url)
+        total = res_obj['total']
+        count = res_obj['count']
+        all_users += res_obj.get('data', {}).get('openid', [])
+        while count < total:
+            next_openid = res_obj.get('next_openid')
+            if not next_openid or not res_obj['count']:
+                break  # 防止死循环
+            res_obj = await self.get(url, next_openid=next_openid)
+            count += res_obj['count']
+            all_users += res_obj.get('data', {}).get('openid', [])
+        logging.info("成功获取所有用户:[%d]位" % len(all_users))
+        return all_users
+
+    ###################
+    # 多媒体管理
+    ###################
+    async def upload_media(self, file_path, file_type):
+        # type: (str, str) -> dict
+        """
+        上传指定文件，成功则返回对应的 `media_id`
+        :param file_type: 'image' 'thumb', 'voice', 'video'
+        :return: `None` if failed else dict
+        """
+        url = 'http://file.api.weixin.qq.com/cgi-bin/media/upload'
+        _check_media_file(file_path, file_type)
+        with open(file_path, 'rb') as media:
+            form = aiohttp.FormData()
+            form.add_field('media', media, filename=os.path.basename(file_path))
+            try:
+                res_obj = await self.post(url, data=form, params=dict(type=file_type))
+            except WeChatError as e:
+                logging.error("上传文件失败")
+                logging.error(e.errorEnMsg)
+                return None
+        logging.info('uploadMedia上传文件成功,media_id:[%s]' % res_obj['media_id'])
+        return res_obj
+
+    async def download_media(self, media_id, des_path, overwrite=False):
+        # type: (str, str, bool) -> bool
+        """下载指定的 `media_id` 并存储; 微信返回的不是文件(如视频的 video_url)时不写入, 返回该 JSON(dict)"""
+        if os.path.exists(os.path.abspath(des_path)) and (not overwrite):
+            logging.error("指令路径文件已存在，且未指定覆盖")
+            raise WXApiError("指令路径文件已存在，且未指定覆盖")
+        url = 'http://file.api.weixin.qq.com/cgi-bin/media/get'
+        params = dict(media_id=media_id, access_token=await self.get_access_token())
+        try:
+            bin_data = await self.download(url, params=params)
+        except WeChatError as e:
+            logging.error(e.errorEnMsg)
+        else:
+            if isinstance(bin_data, dict):
+                return bin_data
+            with open(des_path, 'wb') as f:
+                f.write(bin_data)
+            logging.info("文件下载保存成功")
+            return True
+
+    ###############
+    # 推广二维码管理
+    ###############
+    async def create_qrcode(self, scene_value, expire_seconds=2592000):
+        """创建二维码, 返回换取二维码图片的URL, 参数同 `MPCenter.create_qrcode`"""
+        url = 'https://api.weixin.qq.com/cgi-bin/qrcode/create'
+        params = _qrcode_params(scene_value, expire_seconds)
+        try:
+            res_obj = await self.post(url, json=params)
+        except WeChatError as e:
+            logging.error("创建二维码出错")
+            logging.error(e.errorEnMsg)
+        else:
+            return _qrcode_url(res_obj['ticket'])
+
+    async def save_qrcode(self, des_path, qr_url, overwrite=True):
+        # type: (str, str, bool) -> bool
+        """将指定的二维码url保存到本地"""
+        if os.path.exists(os.path.abspath(des_path)) and (not overwrite):
+            logging.error("指令路径文件已存在，且未指定覆盖")
+            raise WXApiError("指令路径文件已存在，且未指定覆盖")
+        bin_data = await self.download(qr_url)
+        if isinstance(bin_data, dict):
+            raise WXApiError("二维码地址返回的不是图片")
+        with open(des_path, 'wb') as f:
+            f.write(bin_data)
+        logging.info("文件下载保存成功")
+        return True
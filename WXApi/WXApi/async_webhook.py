@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+`WebhookApp` 的 ASGI 版本, 需要 Python 3.5+
+"""
+
+import asyncio
+
+from .webhook import WebhookApp
+
+__all__ = ['ASGIWebhookApp']
+
+
+class ASGIWebhookApp(WebhookApp):
+    """
+    微信回调的 ASGI 应用, 参数及处理函数注册同 `WebhookApp`
+    处理函数(及 `DeferredReplier` 的等待)在线程池中执行, 不阻塞事件循环
+    :param executor: 执行处理函数的 `concurrent.futures.Executor`, 默认使用事件循环的默认线程池
+    """
+
+    def __init__(self, token, executor=None, **kwargs):
+        super(ASGIWebhookApp, self).__init__(token, **kwargs)
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        method = scope['method']
+        body = b''
+        if method == 'POST':
+            body = await self._read_body(receive)
+            if body is None:
+                return await self._respond(send, 413, b'')
+        status, data = await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.handle, method, scope.get('query_string', b''), body)
+        await self._respond(send, status, data)
+
+    async def _read_body(self, receive):
+        """读取请求体, 只有一段时直接使用不再拼接; 超过 `max_body` 返回 None"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body:
+                return None
+            if chunk:
+                chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    @staticmethod
+    async def _respond(send, status, data):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/xml; charset=utf-8'),
+                                (b'content-length', str(len(data)).encode('ascii'))]})
+        await send({'type': 'http.response.body', 'body': data})
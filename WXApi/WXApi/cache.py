@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+进程内的缓存工具
+"""
+import threading
+from collections import OrderedDict
+from time import time
+
+__all__ = ['TTLCache']
+
+
+class TTLCache(object):
+    """
+    线程安全的 LRU 缓存, 条目写入 `ttl` 秒后过期, 超过 `maxsize` 个时淘汰最久未使用的条目
+    `hits` `misses` 记录 `get` 的命中/未命中次数; 条目内还有下一级查找时, 以 `get(counted=False)` 读取并由 `record` 计数
+    """
+
+    def __init__(self, maxsize=1024, ttl=600, timer=time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (过期时间, value), 最近使用的在末尾
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, counted=True):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None and item[0] > self.timer():
+                self._data[key] = item
+                if counted:
+                    self.hits += 1
+                return item[1]
+            if counted:
+                self.misses += 1
+            return default
+
+    def record(self, hit):
+        """计入一次命中(`hit` 为 True)或未命中"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """`key` 不存在或已过期时写入并返回 True, 否则不改变缓存并返回 False, 检查与写入是原子的"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > self.timer():
+                return False
+            self._data.pop(key, None)
+            self._data[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and item[0] > self.timer()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._data))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+安全模式(AES-CBC)下消息的解密/加密及 msg_signature 校验
+需要安装 cryptography 或 pycryptodome 其中之一(`pip install pyweipi[crypto]`)
+"""
+import os
+import struct
+from base64 import (b64decode, b64encode)
+from hashlib import sha1 as _sha1
+from time import time
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import (Cipher, algorithms, modes)
+except ImportError:
+    Cipher = None
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+from .WXError import WXApiError
+from .event import EmptyReply
+from .WXUtils import (xml2json, _compare_digest)
+
+__all__ = ['MessageCrypto']
+
+_ENCRYPTED_XML = ('<xml><Encrypt><![CDATA[%s]]></Encrypt><MsgSignature><![CDATA[%s]]></MsgSignature>'
+                  '<TimeStamp>%s</TimeStamp><Nonce><![CDATA[%s]]></Nonce></xml>')
+_BLOCK_SIZE = 32  # 微信使用 32 字节为块长度的 PKCS#7 填充
+
+
+class MessageCrypto(object):
+    """
+    绑定 Token/EncodingAESKey/AppID 的消息加解密, 创建一次后每个请求复用
+    EncodingAESKey 只解码一次, AES 密钥扩展后的 cipher 对象也只创建一次(cryptography 后端)
+    :param token: 公众号后台配置的 Token
+    :param encoding_aes_key: 公众号后台配置的 43 位 EncodingAESKey
+    :param app_id: 公众号的 AppID, 解密时校验消息中的 AppID
+    """
+
+    def __init__(self, token, encoding_aes_key, app_id, encoding="utf-8"):
+        if Cipher is None and AES is None:
+            raise WXApiError("安全模式需要安装 cryptography 或 pycryptodome")
+        try:
+            key = b64decode(encoding_aes_key + '=')
+        except (TypeError, ValueError):
+            key = b''
+        if len(key) != 32:
+            raise WXApiError("EncodingAESKey 不合法")
+        self.encoding = encoding
+        self.token = token.encode(encoding)
+        self.app_id = app_id.encode(encoding)
+        self._key = key
+        if Cipher is not None:
+            self._cipher = Cipher(algorithms.AES(key), modes.CBC(key[:16]), backend=default_backend())
+        else:
+            self._cipher = None
+
+    def _aes(self, data, decrypt):
+        # type: (bytes, bool) -> bytes
+        if self._cipher is not None:
+            context = self._cipher.decryptor() if decrypt else self._cipher.encryptor()
+            result = context.update(data)
+            tail = context.finalize()  # 数据按块对齐, 一般为空
+            return result + tail if tail else result
+        aes = AES.new(self._key, AES.MODE_CBC, self._key[:16])
+        return aes.decrypt(data) if decrypt else aes.encrypt(data)
+
+    def signature(self, timestamp, nonce, encrypt):
+        # type: (str, str, str) -> str
+        """计算 msg_signature"""
+        parts = [self.token, timestamp.encode(self.encoding), nonce.encode(self.encoding),
+                 encrypt if isinstance(encrypt, bytes) else encrypt.encode(self.encoding)]
+        parts.sort()
+        return _sha1(b''.join(parts)).hexdigest()
+
+    def verify(self, args, encrypt):
+        # type: (dict, str) -> bool
+        """以请求参数中的 msg_signature, timestamp, nonce 校验密文 `encrypt`, 正确返回 True"""
+        try:
+            expected = self.signature(args['timestamp'], args['nonce'], encrypt)
+            return _compare_digest(expected.encode('ascii'), args['msg_signature'].encode('ascii'))
+        except (KeyError, TypeError, AttributeError, UnicodeError):
+            return False
+
+    def decrypt(self, encrypt):
+        # type: (str) -> bytes
+        """解密 Base64 密文, 返回消息明文(bytes); 密文或 AppID 不合法时抛出 `WXApiError`"""
+        try:
+            data = b64decode(encrypt)
+        except (TypeError, ValueError):
+            raise WXApiError("密文不是合法的 Base64")
+        if not data or len(data) % 16:
+            raise WXApiError("密文长度不合法")
+        plain = self._aes(data, decrypt=True)
+        # 16字节随机串 + 4字节网络序长度 + 消息 + AppID + 填充
+        pad = ord(plain[-1:])
+        end = len(plain) - pad
+        if not 0 < pad <= _BLOCK_SIZE or end < 20:
+            raise WXApiError("解密后的填充不合法")
+        length = struct.unpack_from('>I', plain, 16)[0]
+        if plain[20 + length:end] != self.app_id:
+            raise WXApiError("消息的 AppID 不匹配")
+        return plain[20:20 + length]
+
+    def encrypt(self, plain):
+        # type: (bytes) -> str
+        """加密消息明文, 返回 Base64 密文"""
+        size = 20 + len(plain) + len(self.app_id)
+        pad = _BLOCK_SIZE - size % _BLOCK_SIZE
+        data = b''.join((os.urandom(16), struct.pack('>I', len(plain)), plain, self.app_id,
+                         struct.pack('B', pad) * pad))
+        return b64encode(self._aes(data, decrypt=False)).decode('ascii')
+
+    def decrypt_message(self, args, xml_data):
+        # type: (dict, bytes) -> bytes
+        """
+        校验并解密微信推送的加密报文, 返回明文报文, 可直接交给 `xml2event`
+        :param args: 请求 URL 中的参数, 需包含 msg_signature, timestamp, nonce
+        :raise WXApiError: 报文/签名/密文不合法
+        """
+        encrypt = xml2json(xml_data, self.encoding).get('Encrypt')
+        if not encrypt:
+            raise WXApiError("报文中没有 Encrypt 节点")
+        if not self.verify(args, encrypt):
+            raise WXApiError("msg_signature 校验失败")
+        return self.decrypt(encrypt)
+
+    def decrypt_echostr(self, args):
+        # type: (dict) -> bytes
+        """校验服务器配置时, 校验并解密 echostr, 返回应原样回复的明文"""
+        echostr = args.get('echostr')
+        if not echostr or not self.verify(args, echostr):
+            raise WXApiError("msg_signature 校验失败")
+        return self.decrypt(echostr)
+
+    def encrypt_reply(self, reply, nonce, timestamp=None):
+        # type: (object, str, str) -> bytes
+        """
+        加密回复报文, 返回可直接响应给微信的加密报文
+        :param reply: `ReplyObject` 或已生成的明文报文(bytes)
+        :param nonce: 随机串, 一般使用请求中的 nonce
+        """
+        if isinstance(reply, EmptyReply):  # "success" 无需加密
+            return reply.render(self.encoding)
+        plain = reply if isinstance(reply, bytes) else reply.render(self.encoding)
+        timestamp = timestamp or str(int(time()))
+        encrypt = self.encrypt(plain)
+        xml = _ENCRYPTED_XML % (encrypt, self.signature(timestamp, nonce, encrypt), timestamp, nonce)
+        return xml.encode(self.encoding)
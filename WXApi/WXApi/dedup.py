@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+回调消息去重: 5 秒内未响应时微信最多重试 3 次推送同一条消息, 在交给处理函数前丢弃重复的推送
+消息以 MsgId 为键, 事件以 FromUserName + CreateTime 为键
+实现其他后端(如 Redis)时继承 `DedupStore` 并实现 `add` 方法
+"""
+import os
+import struct
+import threading
+from hashlib import md5
+from time import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .WXError import WXApiError
+from .cache import TTLCache
+from .event import WeChatMsg
+
+__all__ = ['message_key', 'DedupStore', 'MemoryDedupStore', 'FileDedupStore']
+
+
+def message_key(msg):
+    # type: (object) -> str
+    """
+    返回消息/事件的去重键, `msg` 可以是 `xml2event` 返回的对象或 `xml2json` 返回的 dict
+    只读取 from_id/time/MsgId: 延迟解析(lazy)的对象从其保存的原始字段中取 MsgId, 不会触发解析
+    """
+    if isinstance(msg, dict):
+        if msg.get('MsgId'):
+            return 'msg:%s' % msg['MsgId']
+        return 'event:%s:%s' % (msg['FromUserName'], msg['CreateTime'])
+    if isinstance(msg, WeChatMsg):
+        try:
+            message_id = object.__getattribute__(msg, '_msg').get('MsgId')  # 尚未解析的 lazy 对象
+        except AttributeError:
+            message_id = msg.message_id
+        if message_id:
+            return 'msg:%s' % message_id
+    return 'event:%s:%s' % (msg.from_id, msg.time)
+
+
+class DedupStore(object):
+    """
+    去重存储接口
+    :param window: 记录保留的秒数, 应大于微信重试的总时长(约15秒)
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+
+    def add(self, key):
+        # type: (str) -> bool
+        """`window` 秒内首次出现 `key` 时记录并返回 True, 重复时返回 False, 检查与记录须是原子的"""
+        raise NotImplementedError
+
+    def is_duplicate(self, msg):
+        # type: (object) -> bool
+        """`msg` 已在 `window` 秒内出现过时返回 True, 否则记录下来并返回 False"""
+        return not self.add(message_key(msg))
+
+
+class MemoryDedupStore(DedupStore):
+    """进程内的 LRU 存储, 最多记录 `maxsize` 条"""
+
+    def __init__(self, window=60, maxsize=10000):
+        super(MemoryDedupStore, self).__init__(window)
+        self._cache = TTLCache(maxsize, window)
+
+    def add(self, key):
+        return self._cache.add(key, True)
+
+
+_FILE_MAGIC = b'WXDEDUP1'
+_FILE_HEADER = struct.Struct('>8sI')  # 标识, 槽位组数
+_SLOT = struct.Struct('>d16s')  # 过期时间, 键的 md5
+_GROUP_SLOTS = 16  # 每组的槽位数, 键只存放在其哈希对应的组内
+_GROUP_SIZE = _SLOT.size * _GROUP_SLOTS
+
+
+def _read_at(fd, offset, size):
+    os.lseek(fd, offset, os.SEEK_SET)
+    data = b''
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _write_at(fd, offset, data):
+    os.lseek(fd, offset, os.SEEK_SET)
+    while data:
+        data = data[os.write(fd, data):]
+
+
+class FileDedupStore(DedupStore):
+    """
+    基于本地文件的存储, 同一主机上的多个 worker 进程共享
+    文件由固定大小的槽位组成, 键按哈希落到一组(16个)槽位中, 每次 `add` 只以 `fcntl.lockf` 锁定并读写该组:
+    写入时覆盖组内已过期或最早到期的槽位, 无需整体重写或清理, 耗时与记录数无关
+    最多保留约 `maxsize` 条(文件按其四倍预留槽位, 某组写满时才提前淘汰), 同一文件的所有进程须使用相同的 `maxsize`
+    """
+
+    def __init__(self, path, window=60, maxsize=10000):
+        if fcntl is None:
+            raise WXApiError("FileDedupStore 需要 fcntl 支持")
+        super(FileDedupStore, self).__init__(window)
+        self.path = path
+        self.maxsize = maxsize
+        self._groups = max(1, (maxsize * 4 + _GROUP_SLOTS - 1) // _GROUP_SLOTS)
+        self._lock = threading.Lock()  # lockf 只在进程之间互斥, 同一进程内的线程由它互斥
+        self._fd = None
+        self._pid = None
+        self._init_file()
+
+    def _fileno(self):
+        # fork 出的子进程重新打开文件, 不与父进程共用文件偏移
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+
+    def close(self):
+        """关闭数据文件, 之后再调用 `add` 时重新打开"""
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = self._pid = None
+
+    def _init_file(self):
+        """文件不存在、为旧格式或槽位组数不同时重新初始化"""
+        header = _FILE_HEADER.pack(_FILE_MAGIC, self._groups)
+        with self._lock:
+            fd = self._fileno()
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                size = _FILE_HEADER.size + self._groups * _GROUP_SIZE
+                if _read_at(fd, 0, _FILE_HEADER.size) != header or os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    _write_at(fd, 0, header)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def add(self, key):
+        digest = md5(key.encode('utf-8')).digest()
+        offset = _FILE_HEADER.size + struct.unpack_from('>Q', digest)[0] % self._groups * _GROUP_SIZE
+        with self._lock:
+            fd = self._fileno()
+            fcntl.lockf(fd, fcntl.LOCK_EX, _GROUP_SIZE, offset)
+            try:
+                data = _read_at(fd, offset, _GROUP_SIZE)
+                now = time()
+                slots = [_SLOT.unpack_from(data, index * _SLOT.size) for index in range(_GROUP_SLOTS)]
+                for expires, slot_digest in slots:
+                    if slot_digest == digest and expires > now:
+                        return False
+                index = min(range(_GROUP_SLOTS), key=lambda i: slots[i][0])  # 空槽位的过期时间为 0
+                _write_at(fd, offset + index * _SLOT.size, _SLOT.pack(now + self.window, digest))
+                return True
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, _GROUP_SIZE, offset)
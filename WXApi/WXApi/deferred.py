@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+延迟回复: 微信要求 5 秒内响应回调, 处理函数超出时限时先回复 "success", 处理完成后再以客服消息接口发送结果
+"""
+import logging
+import threading
+from concurrent.futures import (ThreadPoolExecutor, TimeoutError)
+from time import time
+
+from .event import EmptyReply
+
+__all__ = ['DeferredReplier']
+
+
+class DeferredReplier(object):
+    """
+    以 `workers` 个线程执行处理函数, 在 `budget` 秒内完成时直接返回其回复(被动回复);
+    超时则返回 `EmptyReply`, 处理函数完成后将回复转为客服消息, 由 `send_workers` 个线程通过 `center.reply` 发送
+    用法: `reply = replier(handler, msg)` 代替 `reply = handler(msg)`
+    :param center: `MPCenter`
+    :param budget: 等待处理函数的秒数, 需给解析及网络传输留出余量
+    :param max_pending: 等待发送的客服消息上限, 超出时丢弃并计入 dropped
+    `stats` 给出各项计数、队列深度及延迟回复的迟到时间(从收到消息到客服消息发出)
+    """
+
+    def __init__(self, center, budget=4.0, workers=16, send_workers=4, max_pending=1000):
+        self.center = center
+        self.budget = budget
+        self.max_pending = max_pending
+        self.counts = dict(in_time=0, deferred=0, sent=0, failed=0, dropped=0)
+        self._handlers = ThreadPoolExecutor(max_workers=workers)
+        self._senders = ThreadPoolExecutor(max_workers=send_workers)
+        self._running = 0  # 已提交未完成的处理函数
+        self._pending = 0  # 等待发送或正在发送的客服消息
+        self._lateness_total = 0.0
+        self._lateness_max = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, handler, msg):
+        """执行 `handler(msg)`, 返回应立即回复的 `ReplyObject`; 处理函数在时限内抛出的异常原样抛出"""
+        start = time()
+        with self._lock:
+            self._running += 1
+        future = self._handlers.submit(handler, msg)
+        future.add_done_callback(self._handler_done)
+        try:
+            reply = future.result(timeout=self.budget)
+        except TimeoutError:
+            self._count('deferred')
+            future.add_done_callback(lambda done: self._defer(done, start))
+            return EmptyReply(msg)
+        self._count('in_time')
+        return reply
+
+    def _handler_done(self, future):
+        with self._lock:
+            self._running -= 1
+
+    def _defer(self, future, start):
+        error = future.exception()
+        if error is not None:
+            logging.error("延迟回复的处理函数出错:%r" % error)
+            self._count('failed')
+            return
+        reply = future.result()
+        data = reply.custom_message() if reply is not None else None
+        if data is None:  # 处理函数没有需要回复的内容
+            return
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.counts['dropped'] += 1
+                logging.error("待发送的延迟回复过多, 丢弃发给[%s]的消息" % data['touser'])
+                return
+            self._pending += 1
+        self._senders.submit(self._send, data, start)
+
+    def _send(self, data, start):
+        try:
+            ok = self.center.reply(data)
+        except Exception as e:
+            logging.error("延迟回复发送失败[%s]:%r" % (data['touser'], e))
+            ok = False
+        lateness = time() - start
+        with self._lock:
+            self._pending -= 1
+            self.counts['sent' if ok else 'failed'] += 1
+            if ok:
+                self._lateness_total += lateness
+                self._lateness_max = max(self._lateness_max, lateness)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        # type: () -> dict
+        """计数, 处理中的消息数(handler_depth), 待发送的客服消息数(send_depth), 已发送延迟回复的平均/最大迟到秒数"""
+        with self._lock:
+            sent = self.counts['sent']
+            return dict(self.counts, handler_depth=self._running, send_depth=self._pending,
+                        lateness_avg=self._lateness_total / sent if sent else 0.0,
+                        lateness_max=self._lateness_max)
+
+    def close(self, wait=True):
+        """停止接收新消息; `wait` 为 True 时等待处理中的消息及延迟回复发送完毕"""
+        self._handlers.shutdown(wait=wait)
+        self._senders.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
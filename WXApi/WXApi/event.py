@@ -7,12 +7,27 @@ import warnings
 
 __date__ = "2017/11/22"
 
-__all__ = ['TextMsg', 'ImageMsg', 'VoiceMsg', 'VideoMsg', 'LocationMsg', 'LinkMsg',
+__all__ = ['register_event_type', 'TextMsg', 'ImageMsg', 'VoiceMsg', 'VideoMsg', 'LocationMsg', 'LinkMsg',
            'SubEvent', 'UnSubEvent', 'ScanEvent', 'ClickEvent', 'ViewEvent', 'LocationEvent',
+           'QASuccessEvent', 'QAFailedEvent', 'NamingSuccessEvent', 'NamingFailedEvent', 'RemindEvent', 'NotifyEvent',
            'ReplyObject', 'EmptyReply', 'TextReply', 'ImageReply', 'VoiceReply', 'VideoReply', 'MusicReply',
            'NewsReply']
 
 
+# (MsgType, Event) -> 类, 消息的 Event 为 None, `xml2event` 据此直接查表
+_EVENT_TYPES = dict()
+
+
+def register_event_type(msg_type, event=None):
+    """注册 `xml2event` 可返回的消息/事件类, 消息只需给出 MsgType, 事件还需给出 Event(不区分大小写)"""
+
+    def decorator(cls):
+        _EVENT_TYPES[(msg_type, event.lower() if event else None)] = cls
+        return cls
+
+    return decorator
+
+
 class Msg(dict):
     def __setattr__(self, key, value):
         object.__setattr__(self, key, value)
@@ -24,15 +39,73 @@ class Msg(dict):
             return None
 
 
+_SLOT_NAMES = dict()  # 类 -> 其及父类的全部字段(不含 `_msg`)
+
+
+def _slot_names(cls):
+    try:
+        return _SLOT_NAMES[cls]
+    except KeyError:
+        names = tuple(name for klass in cls.__mro__ for name in klass.__dict__.get('__slots__', ())
+                      if name != '_msg')
+        _SLOT_NAMES[cls] = names
+        return names
+
+
 class WeChatObject(object):
+    __slots__ = ('from_id', 'to_id', 'time', '_msg')
+
     def __init__(self, msg):
         super(WeChatObject, self).__init__()
         self.from_id = msg['FromUserName']
         self.to_id = msg['ToUserName']
         self.time = msg['CreateTime']
 
+    @classmethod
+    def lazy(cls, msg):
+        """延迟解析: 只取出 from_id/to_id/time, 其余字段在首次访问时才解析(并校验), 解析失败时抛出 AttributeError"""
+        obj = cls.__new__(cls)
+        obj.from_id = msg['FromUserName']
+        obj.to_id = msg['ToUserName']
+        obj.time = msg['CreateTime']
+        obj._msg = msg
+        return obj
+
+    def __getattr__(self, item):
+        # 只有 `lazy` 创建且尚未解析的对象会走到这里, 解析一次后字段即缓存在对象上
+        # 先解析到新对象, 成功后再写回并清除 `_msg`: 解析失败时对象保持原状, 每次访问都抛出同样的 AttributeError,
+        # 其他线程同时访问时各自解析, 不会看到只填了一半的对象
+        try:
+            msg = object.__getattribute__(self, '_msg')
+        except AttributeError:
+            raise AttributeError(item)
+        cls = type(self)
+        decoded = cls.__new__(cls)
+        try:
+            cls.__init__(decoded, msg)
+        except (KeyError, AssertionError, AttributeError, TypeError, ValueError) as e:
+            raise AttributeError("%s: 消息解析失败 %r" % (item, e))
+        for name in _slot_names(cls):
+            try:
+                setattr(self, name, object.__getattribute__(decoded, name))
+            except AttributeError:  # 该字段未赋值
+                pass
+        try:  # 未声明 __slots__ 的子类(如 `register_event_type` 注册的类)将字段存放在 __dict__ 中
+            fields = object.__getattribute__(decoded, '__dict__')
+        except AttributeError:
+            pass
+        else:
+            object.__getattribute__(self, '__dict__').update(fields)
+        try:
+            del self._msg
+        except AttributeError:  # 其他线程已写回
+            pass
+        return object.__getattribute__(self, item)
+
 
 class WeChatMsg(WeChatObject):
+    __slots__ = ('type', 'message_id')
+
     def __init__(self, msg):
         super(WeChatMsg, self).__init__(msg)
         self.type = msg['MsgType'].lower()
@@ -46,26 +119,36 @@ class WeChatMsg(WeChatObject):
 
 
 class WeChatMedia(WeChatMsg):
+    __slots__ = ('media_id',)
+
     def __init__(self, msg):
         super(WeChatMedia, self).__init__(msg)
         self.media_id = msg['MediaId']
 
 
 class WeChatEvent(WeChatObject):
+    __slots__ = ('event',)
+
     def __init__(self, msg):
         super(WeChatEvent, self).__init__(msg)
         assert msg['MsgType'] == 'event', "不是事件类型"
         self.event = msg['Event'].lower()
 
 
+@register_event_type('text')
 class TextMsg(WeChatMsg):
+    __slots__ = ('content',)
+
     def __init__(self, msg):
         super(TextMsg, self).__init__(msg)
         assert self.type == 'text', "消息不是文本类型消息"
         self.content = msg['Content']
 
 
+@register_event_type('voice')
 class VoiceMsg(WeChatMedia):
+    __slots__ = ('format', 'recognition')
+
     def __init__(self, msg):
         super(VoiceMsg, self).__init__(msg)
         assert self.type == 'voice', "消息不是语音类型消息"
@@ -73,21 +156,30 @@ class VoiceMsg(WeChatMedia):
         self.recognition = msg.get('Recognition')  # 可以没有
 
 
+@register_event_type('video')
 class VideoMsg(WeChatMedia):
+    __slots__ = ('thumb_media_id',)
+
     def __init__(self, msg):
         super(VideoMsg, self).__init__(msg)
         assert self.type == 'video', "消息不是语音类型消息"
         self.thumb_media_id = msg['ThumbMediaId']
 
 
+@register_event_type('image')
 class ImageMsg(WeChatMedia):
+    __slots__ = ('image_link',)
+
     def __init__(self, msg):
         super(ImageMsg, self).__init__(msg)
         assert self.type == 'image', "消息不是语音类型消息"
         self.image_link = msg['PicUrl']
 
 
+@register_event_type('location')
 class LocationMsg(WeChatMsg):
+    __slots__ = ('x', 'y', 'scale', 'label')
+
     def __init__(self, msg):
         super(LocationMsg, self).__init__(msg)
         assert self.type == 'location', "消息不是定位类型消息"
@@ -97,7 +189,10 @@ class LocationMsg(WeChatMsg):
         self.label = msg['Label']  # 地理位置信息
 
 
+@register_event_type('link')
 class LinkMsg(WeChatMsg):
+    __slots__ = ('title', 'description', 'link')
+
     def __init__(self, msg):
         super(LinkMsg, self).__init__(msg)
         assert self.type == 'link', "消息不是链接类型消息"
@@ -106,7 +201,10 @@ class LinkMsg(WeChatMsg):
         self.link = msg['Url']
 
 
+@register_event_type('event', 'subscribe')
 class SubEvent(WeChatEvent):
+    __slots__ = ('event_key', 'ticket')
+
     def __init__(self, msg):
         super(SubEvent, self).__init__(msg)
         assert self.event == 'subscribe', "不是订阅事件"
@@ -116,13 +214,19 @@ class SubEvent(WeChatEvent):
             assert self.ticket.startswith('qrscene_'), "不是二维码订阅事件"
 
 
+@register_event_type('event', 'unsubscribe')
 class UnSubEvent(WeChatEvent):
+    __slots__ = ()
+
     def __init__(self, msg):
         super(UnSubEvent, self).__init__(msg)
         assert self.event == 'unsubscribe', "不是取消订阅事件"
 
 
+@register_event_type('event', 'scan')
 class ScanEvent(WeChatEvent):
+    __slots__ = ('event_key', 'ticket')
+
     def __init__(self, msg):
         super(ScanEvent, self).__init__(msg)
         assert self.event == 'scan', "不是扫描事件"
@@ -130,21 +234,30 @@ class ScanEvent(WeChatEvent):
         self.ticket = msg['Ticket']
 
 
+@register_event_type('event', 'click')
 class ClickEvent(WeChatEvent):
+    __slots__ = ('event_key',)
+
     def __init__(self, msg):
         super(ClickEvent, self).__init__(msg)
         assert self.event == 'click', "不是点击事件"
         self.event_key = msg['EventKey']
 
 
+@register_event_type('event', 'view')
 class ViewEvent(WeChatEvent):
+    __slots__ = ('event_key',)
+
     def __init__(self, msg):
         super(ViewEvent, self).__init__(msg)
         assert self.event == 'view', "不是跳转事件"
         self.event_key = msg['EventKey']
 
 
+@register_event_type('event', 'location')
 class LocationEvent(WeChatEvent):
+    __slots__ = ('x', 'y', 'scale')
+
     def __init__(self, msg):
         super(LocationEvent, self).__init__(msg)
         assert self.event == 'location', "不是定位事件"
@@ -153,48 +266,61 @@ class LocationEvent(WeChatEvent):
         self.scale = msg['Precision']  # 地理位置精度
 
 
+@register_event_type('event', 'qualification_verify_success')
 class QASuccessEvent(WeChatEvent):
     """资质认证成功"""
 
+    __slots__ = ('valid_date',)
+
     def __init__(self, msg):
         super(QASuccessEvent, self).__init__(msg)
         assert self.event == 'qualification_verify_success', "不是资质认证事件"
         self.valid_date = msg['ExpiredTime']
 
 
+@register_event_type('event', 'qualification_verify_fail')
 class QAFailedEvent(WeChatEvent):
     """资质认证失败"""
 
+    __slots__ = ('fail_time', 'fail_reason')
+
     def __init__(self, msg):
         super(QAFailedEvent, self).__init__(msg)
-        assert self.event == 'qualification_verify_success', "不是资质认证事件"
-        self.valid_date = msg['qualification_verify_fail']
+        assert self.event == 'qualification_verify_fail', "不是资质认证事件"
         self.fail_time = msg['FailTime']
         self.fail_reason = msg['FailReason']
 
 
+@register_event_type('event', 'naming_verify_success')
 class NamingSuccessEvent(WeChatEvent):
     """名称认证成功（即命名成功）"""
 
+    __slots__ = ('valid_date',)
+
     def __init__(self, msg):
         super(NamingSuccessEvent, self).__init__(msg)
-        assert self.event == 'qualification_verify_fail', "不是资质认证事件"
+        assert self.event == 'naming_verify_success', "不是名称认证事件"
         self.valid_date = msg['ExpiredTime']
 
 
+@register_event_type('event', 'naming_verify_fail')
 class NamingFailedEvent(WeChatEvent):
     """名称认证失败"""
 
+    __slots__ = ('fail_time', 'fail_reason')
+
     def __init__(self, msg):
         super(NamingFailedEvent, self).__init__(msg)
-        assert self.event == 'naming_verify_fail', "不是资质认证事件"
-        self.valid_date = msg['qualification_verify_fail']
+        assert self.event == 'naming_verify_fail', "不是名称认证事件"
         self.fail_time = msg['FailTime']
         self.fail_reason = msg['FailReason']
 
 
+@register_event_type('event', 'annual_renew')
 class RemindEvent(WeChatEvent):
-    """名称认证失败"""
+    """年审通知"""
+
+    __slots__ = ('valid_date',)
 
     def __init__(self, msg):
         super(RemindEvent, self).__init__(msg)
@@ -202,8 +328,11 @@ class RemindEvent(WeChatEvent):
         self.valid_date = msg['ExpiredTime']
 
 
+@register_event_type('event', 'verify_expired')
 class NotifyEvent(WeChatEvent):
-    """名称认证失败"""
+    """认证过期失效通知"""
+
+    __slots__ = ('valid_date',)
 
     def __init__(self, msg):
         super(NotifyEvent, self).__init__(msg)
@@ -262,7 +391,20 @@ class WeChatXML(object):
         return self.__unicode__() + other.__unicode__()
 
 
+def _reply_template(msg_type, body):
+    """预编译回复报文模板, 依次填入 FromUserName, ToUserName, CreateTime 及 `body` 中的字段"""
+    return ("<xml><FromUserName><![CDATA[%s]]></FromUserName><ToUserName><![CDATA[%s]]></ToUserName>"
+            "<CreateTime>%s</CreateTime><MsgType><![CDATA[" + msg_type + "]]></MsgType>" + body + "</xml>")
+
+
+def _cdata_values(values):
+    """各字段均可按模板以 CDATA 输出时返回 True"""
+    return all(value is not None and type(value) is not int for value in values)
+
+
 class ReplyObject(object):
+    _template = None  # 子类的预编译模板, 未提供时 `render` 退回 `create_xml`
+
     def __init__(self, sender):
         super(ReplyObject, self).__init__()
         self.to_id = sender.from_id
@@ -289,6 +431,32 @@ class ReplyObject(object):
     def create_xml(self):
         return repr(self._create_xml())
 
+    def render(self, encoding="utf-8"):
+        # type: (str) -> bytes
+        """
+        按预编译模板一次填充生成回复报文的 bytes, 内容与 `create_xml` 一致
+        模板中的字段均以 CDATA 包裹, 而 `create_xml` 省略空字段且不以 CDATA 包裹 int, 遇到这些情况时交由 `create_xml` 生成
+        """
+        values = self._template_values()
+        if (self._template is None or values is None or not _cdata_values((self.from_id, self.to_id) + values)
+                or type(self.time) is not int):
+            return self.create_xml().encode(encoding)
+        return (self._template % ((self.from_id, self.to_id, self.time) + values)).encode(encoding)
+
+    def _template_values(self):
+        """按 `_template` 中的顺序给出各字段"""
+        return None
+
+    def custom_message(self):
+        # type: () -> dict
+        """转为客服消息接口的 JSON, 用于超过5秒后以 `MPCenter.reply` 发送同样的内容"""
+        msg_type = self.msg_type()
+        return {'touser': self.to_id, 'msgtype': msg_type, msg_type: self._custom_content()}
+
+    def _custom_content(self):
+        """客服消息中 msgtype 对应的内容"""
+        raise NotImplementedError
+
     def msg_type(self):
         raise NotImplementedError
 
@@ -305,6 +473,12 @@ class EmptyReply(ReplyObject):
     def create_xml(self):
         return "success"
 
+    def render(self, encoding="utf-8"):
+        return b"success"
+
+    def custom_message(self):
+        return None
+
     def node(self):
         pass
 
@@ -313,6 +487,8 @@ class EmptyReply(ReplyObject):
 
 
 class TextReply(ReplyObject):
+    _template = _reply_template("text", "<Content><![CDATA[%s]]></Content>")
+
     def __init__(self, sender, msg):
         super(TextReply, self).__init__(sender)
         self.type = 'text'
@@ -326,8 +502,16 @@ class TextReply(ReplyObject):
         node.add_ele("Content", self.content)
         return node
 
+    def _template_values(self):
+        return self.content,
+
+    def _custom_content(self):
+        return dict(content=self.content)
+
 
 class ImageReply(ReplyObject):
+    _template = _reply_template("image", "<Image><MediaId><![CDATA[%s]]></MediaId></Image>")
+
     def __init__(self, sender, media_id):
         super(ImageReply, self).__init__(sender)
         self.type = 'image'
@@ -341,8 +525,16 @@ class ImageReply(ReplyObject):
         node.add_ele("MediaId", self.media_id)
         return node
 
+    def _template_values(self):
+        return self.media_id,
+
+    def _custom_content(self):
+        return dict(media_id=self.media_id)
+
 
 class VoiceReply(ReplyObject):
+    _template = _reply_template("voice", "<Voice><MediaId><![CDATA[%s]]></MediaId></Voice>")
+
     def __init__(self, sender, media_id):
         super(VoiceReply, self).__init__(sender)
         self.type = 'voice'
@@ -356,8 +548,17 @@ class VoiceReply(ReplyObject):
         node.add_ele("MediaId", self.media_id)
         return node
 
+    def _template_values(self):
+        return self.media_id,
+
+    def _custom_content(self):
+        return dict(media_id=self.media_id)
+
 
 class VideoReply(ReplyObject):
+    _template = _reply_template("video", "<Video><MediaId><![CDATA[%s]]></MediaId><Title><![CDATA[%s]]></Title>"
+                                         "<Description><![CDATA[%s]]></Description></Video>")
+
     def __init__(self, sender, media_id, title, desc):
         super(VideoReply, self).__init__(sender)
         self.type = 'video'
@@ -375,8 +576,18 @@ class VideoReply(ReplyObject):
         node.add_ele("Description", self.description)
         return node
 
+    def _template_values(self):
+        return self.media_id, self.title, self.description
+
+    def _custom_content(self):
+        return dict(media_id=self.media_id, title=self.title, description=self.description)
+
 
 class MusicReply(ReplyObject):
+    _template = _reply_template("music", "<Music><Title><![CDATA[%s]]></Title><Description><![CDATA[%s]]></Description>"
+                                         "<MusicUrl><![CDATA[%s]]></MusicUrl><HQMusicUrl><![CDATA[%s]]></HQMusicUrl>"
+                                         "<ThumbMediaId><![CDATA[%s]]></ThumbMediaId></Music>")
+
     def __init__(self, sender, title, desc, music_url, music_url_hq, media_id):
         super(MusicReply, self).__init__(sender)
         self.type = 'music'
@@ -398,9 +609,19 @@ class MusicReply(ReplyObject):
         node.add_ele("ThumbMediaId", self.media_id)
         return node
 
+    def _template_values(self):
+        return self.title, self.description, self.music_url, self.music_url_hq, self.media_id
+
+    def _custom_content(self):
+        return dict(title=self.title, description=self.description, musicurl=self.music_url,
+                    hqmusicurl=self.music_url_hq, thumb_media_id=self.media_id)
+
 
 class NewsReply(ReplyObject):
     MAX_NUM_OF_NEWS = 8
+    _template = _reply_template("news", "<ArticleCount>%s</ArticleCount><Articles>%s</Articles>")
+    _item_template = ("<item><Title><![CDATA[%s]]></Title><Description><![CDATA[%s]]></Description>"
+                      "<PicUrl><![CDATA[%s]]></PicUrl><Url><![CDATA[%s]]></Url></item>")
 
     def __init__(self, sender, title, desc, picture_url, link):
         super(NewsReply, self).__init__(sender)
@@ -424,6 +645,16 @@ class NewsReply(ReplyObject):
             node.add_ele(None, item)
         return node1 + node
 
+    def _template_values(self):
+        items = [(new['title'], new['description'], new['image_url'], new['link']) for new in self.news]
+        if not all(_cdata_values(item) for item in items):
+            return None
+        return '%d' % len(items), ''.join([NewsReply._item_template % item for item in items])
+
+    def _custom_content(self):
+        return dict(articles=[dict(title=new['title'], description=new['description'], url=new['link'],
+                                   picurl=new['image_url']) for new in self.news])
+
     def add_more_news(self, title, desc, picture_url, link):
         if len(self.news) >= NewsReply.MAX_NUM_OF_NEWS:
             warnings.warn("过多的消息，最多{num}条，不再继续添加".format(num=NewsReply.MAX_NUM_OF_NEWS))
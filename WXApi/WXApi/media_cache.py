@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+临时素材 media_id 的缓存, 以文件内容的哈希为键, 相同内容在 media_id 有效期(3天)内不重复上传
+"""
+import json
+import os
+import threading
+from time import time
+
+from .WXUtils import _atomic_write
+
+__all__ = ['MediaCache']
+
+MEDIA_TTL = 3 * 24 * 3600  # 临时素材在微信服务器上保存3天
+
+
+class MediaCache(object):
+    """
+    线程安全的 media_id 缓存, 键为 (素材类型, 内容哈希)
+    :param path: 指定时持久化到该 JSON 文件, 每次写入后以临时文件原子替换, 重启后仍可使用
+    :param ttl: media_id 的有效秒数, 从微信返回的 `created_at` 算起
+    :param margin: 距过期不足该秒数的 media_id 视为已过期, 避免发送时恰好失效
+    `hits` `misses` 记录 `get` 的命中/未命中次数
+    """
+
+    def __init__(self, path=None, ttl=MEDIA_TTL, margin=3600):
+        self.path = path
+        self.ttl = ttl
+        self.margin = margin
+        self.hits = 0
+        self.misses = 0
+        self._data = dict()  # 'type:digest' -> [media_id, created_at]
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            if content:
+                self._data = json.loads(content.decode('utf-8'))
+
+    @staticmethod
+    def _key(file_type, digest):
+        return '%s:%s' % (file_type, digest)
+
+    def get(self, file_type, digest):
+        # type: (str, str) -> dict
+        """返回仍有效的 dict(type, media_id, created_at), 不存在或已过期返回 None"""
+        with self._lock:
+            item = self._data.get(self._key(file_type, digest))
+            if item is not None and item[1] + self.ttl - self.margin > time():
+                self.hits += 1
+                return dict(type=file_type, media_id=item[0], created_at=item[1])
+            self.misses += 1
+            return None
+
+    def set(self, file_type, digest, media_id, created_at=None):
+        with self._lock:
+            self._data[self._key(file_type, digest)] = [media_id, created_at or int(time())]
+            self._purge()
+            self._save()
+
+    def invalidate(self, media_id):
+        """删除指向 `media_id` 的条目, 如微信返回该 media_id 不合法时"""
+        with self._lock:
+            keys = [key for key, item in self._data.items() if item[0] == media_id]
+            for key in keys:
+                del self._data[key]
+            if keys:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._save()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._data))
+
+    def _purge(self):
+        now = time()
+        for key in [key for key, item in self._data.items() if item[1] + self.ttl <= now]:
+            del self._data[key]
+
+    def _save(self):
+        if self.path is None:
+            return
+        data = json.dumps(self._data).encode('utf-8')
+        _atomic_write(self.path, lambda f: f.write(data))
@@ -6,14 +6,359 @@ from __future__ import unicode_literals
 用于向微信服务器拉取数据和管理
 """
 
+import hashlib
 import logging
 import os
+import random
+import threading
 import requests
-from time import (time)
+from concurrent.futures import (ThreadPoolExecutor, wait, FIRST_COMPLETED)
+from itertools import islice
+from json import (dumps, loads)
+from requests.adapters import HTTPAdapter
+from time import (time, sleep)
 from datetime import datetime
+from io import BytesIO
+from uuid import uuid4
 
 from .WXError import *
-from .WXUtils import (quote, url_encode)
+from .cache import TTLCache
+from .event import (SubEvent, UnSubEvent, ReplyObject)
+from .WXUtils import (quote, url_encode, _atomic_write)
+
+
+def _check_result(result):
+    # type: (dict) -> dict
+    """微信接口返回的 JSON 中 errcode 非 0 时抛出 `WeChatError`"""
+    if 'errcode' in result and result['errcode'] != 0:
+        raise WeChatError(result)
+    return result
+
+
+# 文件头(magic bytes) -> (格式, MIME 类型)
+_MEDIA_MAGIC = (
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'#!AMR\n', 'amr', 'audio/amr'),
+    (b'ID3', 'mp3', 'audio/mpeg'),
+    (b'\xff\xfb', 'mp3', 'audio/mpeg'),
+    (b'\xff\xf3', 'mp3', 'audio/mpeg'),
+    (b'\xff\xf2', 'mp3', 'audio/mpeg'),
+)
+
+# 媒体类型 -> (允许的格式, 大小上限)
+_MEDIA_LIMITS = {
+    'image': (('jpg',), 128 * 1024),
+    'thumb': (('jpg',), 64 * 1024),
+    'voice': (('amr', 'mp3'), 256 * 1024),
+    'video': (('mp4',), 1 * 1024 * 1024),
+}
+
+
+def _sniff_media(head):
+    # type: (bytes) -> tuple
+    """根据文件头判断格式, 返回 (格式, MIME 类型), 无法识别时返回 (None, None)"""
+    for magic, fmt, mime in _MEDIA_MAGIC:
+        if head.startswith(magic):
+            return fmt, mime
+    if head[4:8] == b'ftyp':
+        return 'mp4', 'video/mp4'
+    return None, None
+
+
+def _check_media(head, size, file_type):
+    # type: (bytes, int, str) -> tuple
+    """检查格式/大小是否符合微信的限制, 返回 (格式, MIME 类型), 不符合抛出 `WXApiError`"""
+    fmt, mime = _sniff_media(head)
+    allowed, max_size = _MEDIA_LIMITS.get(file_type, ((), 0))
+    if fmt not in allowed:
+        logging.error("指定的文件类型不支持上传")
+        raise WXApiError("不支持的文件类型或格式")
+    if size > max_size:
+        logging.error("上传%s文件最大为%dKB" % (file_type, max_size // 1024))
+        raise WXApiError("%s文件最大%dKB" % (file_type, max_size // 1024))
+    return fmt, mime
+
+
+def _check_media_file(file_path, file_type):
+    # type: (str, str) -> tuple
+    """上传前检查文件是否存在及类型/大小是否符合微信的限制, 不符合抛出 `WXApiError`"""
+    if not os.path.exists(file_path):
+        logging.error("uploadMedia指定的文件不存在[%s]" % file_path)
+        raise WXApiError("指定路径文件不存在")
+    with open(file_path, 'rb') as f:
+        head = f.read(16)
+    return _check_media(head, os.path.getsize(file_path), file_type)
+
+
+class _BufferReader(object):
+    """以文件的方式分块读取 memoryview, 每次只复制读出的部分"""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+
+class _MediaSource(object):
+    """
+    待上传的媒体: 文件路径、文件对象(包括 mmap) 或 bytes/bytearray/memoryview 等缓冲区
+    路径由本对象打开, 退出 with 块时关闭; 调用者传入的文件对象不会被关闭
+    """
+
+    def __init__(self, media, filename=None):
+        self._file = self._owned = self._view = None
+        if isinstance(media, (type(''), str)):
+            if not os.path.exists(media):
+                logging.error("uploadMedia指定的文件不存在[%s]" % media)
+                raise WXApiError("指定路径文件不存在")
+            self._file = self._owned = open(media, 'rb')
+            self._start = 0
+            self.size = os.fstat(self._file.fileno()).st_size
+            self.name = filename or os.path.basename(media)
+        elif hasattr(media, 'read'):
+            self._file = media
+            self._start = media.tell()
+            media.seek(0, 2)
+            self.size = media.tell() - self._start
+            name = getattr(media, 'name', None)
+            self.name = filename or (os.path.basename(name) if isinstance(name, (type(''), str)) else 'media')
+        else:
+            view = memoryview(media)
+            if view.format != 'B':
+                view = view.cast('B')
+            self._view = view
+            self.size = len(view)
+            self.name = filename or 'media'
+
+    def reader(self):
+        """返回从媒体开头读取的对象, 每次调用都重新开始"""
+        if self._file is None:
+            return _BufferReader(self._view)
+        self._file.seek(self._start)
+        return self._file
+
+    def head(self, size=16):
+        return self.reader().read(size)
+
+    def digest(self, chunk_size=64 * 1024):
+        """分块计算内容的 SHA-1"""
+        sha1 = hashlib.sha1()
+        reader = self.reader()
+        for chunk in iter(lambda: reader.read(chunk_size), b''):
+            sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def close(self):
+        if self._owned is not None:
+            self._owned.close()
+            self._owned = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _MultipartBody(object):
+    """
+    流式的 multipart/form-data 请求体, 只含一个文件字段
+    requests 以 `len()` 设置 Content-Length 后分块调用 `read`, 文件内容不会整体读入内存
+    """
+
+    def __init__(self, field, filename, mime, reader, size):
+        boundary = uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+        head = ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                'Content-Type: %s\r\n\r\n' % (boundary, field, filename, mime)).encode('utf-8')
+        tail = ('\r\n--%s--\r\n' % boundary).encode('utf-8')
+        self._parts = [BytesIO(head), reader, BytesIO(tail)]
+        self._length = len(head) + size + len(tail)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and size != 0:
+            data = self._parts[0].read(size)
+            if not data:
+                self._parts.pop(0)
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(chunks)
+
+
+def _qrcode_params(scene_value, expire_seconds):
+    # type: (object, int) -> dict
+    """生成创建二维码的请求参数"""
+    if expire_seconds <= 2592000 and type(scene_value) is int:
+        if not 0 < scene_value < 2 ** 32:
+            raise WXApiError("微信服务器要求临时二维码的场景编号为32位非0整数")
+        return {
+            "expire_seconds": expire_seconds,
+            "action_name": "QR_SCENE",
+            "action_info": {
+                "scene": {
+                    "scene_id": scene_value
+                }
+            }
+        }
+    if type(scene_value) is int:
+        if not 0 < scene_value <= 100000:
+            raise WXApiError("微信服务器要求给定的场景编号不超过 100000")
+        return {
+            "action_name": "QR_LIMIT_SCENE",
+            "action_info": {
+                "scene": {
+                    "scene_id": scene_value
+                }
+            }
+        }
+    if len(scene_value) > 64:
+        raise WXApiError("微信服务器要求给定的场景标志不超过64个英文字符")
+    return {
+        "action_name": "QR_LIMIT_STR_SCENE",
+        "action_info": {
+            "scene": {
+                "scene_str": str(scene_value)
+            }
+        }
+    }
+
+
+def _qrcode_url(ticket):
+    return 'https://mp.weixin.qq.com/cgi-bin/showqrcode?ticket=' + quote(ticket)
+
+
+def _load_qrcode_manifest(manifest, des_dir):
+    # type: (str, str) -> set
+    """读取 `iter_qrcodes` 的清单, 返回已成功且仍可用的场景值; 同一场景以最后一条记录为准"""
+    records = dict()
+    if os.path.exists(manifest):
+        with open(manifest, 'rb') as f:
+            for line in f:
+                try:
+                    record = loads(line.decode('utf-8'))
+                except ValueError:  # 中断时写了一半的行
+                    continue
+                records[record['scene']] = record
+    now = time()
+    return set(scene for scene, record in records.items()
+               if record['error'] is None
+               and (record['expires_at'] is None or record['expires_at'] > now)
+               and (des_dir is None or (record['path'] and os.path.exists(record['path']))))
+
+
+def _in_background(func, *args):
+    """在后台线程执行 `func(*args)`, 返回等待并取得其结果的函数, 异常在取结果时抛出"""
+    result = dict()
+
+    def run():
+        try:
+            result['value'] = func(*args)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    def wait():
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    return wait
+
+
+def _copy_stream(response, dest, chunk_size):
+    """将响应内容分块写入文件对象或可写缓冲区(bytearray/memoryview), 返回写入的字节数"""
+    written = 0
+    if hasattr(dest, 'write'):
+        for chunk in response.iter_content(chunk_size):
+            dest.write(chunk)
+            written += len(chunk)
+        return written
+    view = memoryview(dest)
+    for chunk in response.iter_content(chunk_size):
+        end = written + len(chunk)
+        if end > len(view):
+            raise WXApiError("缓冲区不足以容纳下载的内容")
+        view[written:end] = chunk
+        written = end
+    return written
+
+
+def _reply_json(mp_reply, openid=None):
+    # type: (object, str) -> dict
+    """将 `MPReply`, `ReplyObject` 或 dict 转为客服消息接口的 JSON, 指定 `openid` 时发给该用户"""
+    if isinstance(mp_reply, ReplyObject):
+        mp_reply = mp_reply.custom_message()
+    data = dict(mp_reply.__dict__ if isinstance(mp_reply, MPReply) else mp_reply)
+    if openid is not None:
+        data['touser'] = openid
+    return data
+
+
+def _reply_media_id(mp_reply):
+    """取出客服消息中引用的 media_id, 没有时返回 None"""
+    data = _reply_json(mp_reply)
+    content = data.get(data.get('msgtype'))
+    return content.get('media_id') if isinstance(content, dict) else None
+
+
+class _RateLimiter(object):
+    """多个线程共享的限速器, 每秒放行不超过 `qps` 次, 各次调用均匀间隔"""
+
+    def __init__(self, qps):
+        self.interval = 1.0 / qps
+        self._next = time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            sleep(at - now)
+
+
+def _chunks(iterable, size):
+    """将 `iterable` 按需切分为长度不超过 `size` 的列表"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bounded_map(func, items, workers):
+    """
+    以 `workers` 个线程执行 `func(item)`, 按完成顺序产出 (item, 结果, 异常)
+    `items` 按需读取, 已提交未完成的任务不超过 2 * `workers` 个
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = dict((executor.submit(func, item), item) for item in islice(items, workers * 2))
+        while pending:
+            done = wait(pending, return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, None if error is not None else future.result(), error
+            for item in islice(items, len(done)):
+                pending[executor.submit(func, item)] = item
 
 
 class MPReply(object):
@@ -25,9 +370,28 @@ class MPReply(object):
 class MPCenter(object):
     """
     微信公众号后台接口
+    所有请求复用同一个 `requests.Session` 连接池, 用完后调用 `close` 或以 `with` 语句管理
+    :param session: 外部提供的 `requests.Session`, 此时由调用方负责关闭
+    :param pool_size: 每个域名保持的连接数
+    :param keep_alive: 为 False 时每次请求后关闭连接
+    :param timeout: 请求超时秒数(连接, 读取)
+    :param token_store: `TokenStore` 共享存储, 多进程/多机部署时共用 access_token 且只有一个刷新者
+    :param max_retries: 请求失败后的最大重试次数; access_token 失效时刷新后重试,
+                        系统繁忙(-1)或调用频率超限时按 `backoff` 起的指数退避(随机抖动, 不超过 `max_backoff` 秒)重试
+    :param user_cache_size: 大于 0 时缓存 `get_user_info` `get_user_gid` 的结果, 每个接口最多缓存该数量的用户
+    :param user_info_ttl: 用户信息缓存秒数
+    :param user_gid_ttl: 用户分组缓存秒数
+    :param media_cache: `MediaCache`, 指定时 `upload_media` 按内容哈希复用未过期的 media_id
+    `retry_counts` 记录各类原因的重试次数, 以及重试用尽后放弃的次数
+    access_token 过期时只有一个线程刷新, 其他线程等待其结果; `start_token_refresher` 可在过期前于后台提前刷新
     """
+    MIN_REFRESH_INTERVAL = 60  # 后台刷新的最小间隔(秒)
+    REPLY_QPS = 50  # 群发客服消息的默认速率(次/秒)
 
-    def __init__(self, app_id, app_secret, enable_token_cache=True, token=None, expires=None):
+    def __init__(self, app_id, app_secret, enable_token_cache=True, token=None, expires=None,
+                 session=None, pool_size=10, keep_alive=True, timeout=(5, 30), token_store=None,
+                 max_retries=3, backoff=0.5, max_backoff=8,
+                 user_cache_size=0, user_info_ttl=3600, user_gid_ttl=600, media_cache=None):
         super(MPCenter, self).__init__()
         self.app_id = app_id
         self.app_secret = app_secret
@@ -37,27 +401,122 @@ class MPCenter(object):
             self.access_token_date = None
         else:
             self.access_token_date = datetime.fromtimestamp(expires)
+        self.timeout = timeout
+        self.token_store = token_store
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_counts = dict(token_expired=0, system_busy=0, rate_limited=0, network_error=0,
+                                 gave_up=0)
+        self._stats_lock = threading.Lock()
+        if user_cache_size > 0:
+            self.user_info_cache = TTLCache(user_cache_size, user_info_ttl)
+            self.user_gid_cache = TTLCache(user_cache_size, user_gid_ttl)
+        else:
+            self.user_info_cache = self.user_gid_cache = None
+        self.media_cache = media_cache
+        self._token_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_stop = threading.Event()
+        self._own_session = session is None
+        self.session = session if session is not None else self._create_session(pool_size, keep_alive)
+
+    @staticmethod
+    def _create_session(pool_size, keep_alive):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """停止后台刷新并关闭自行创建的连接池"""
+        self.stop_token_refresher()
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def get(self, url, **kwargs):
         # type: (object, dict) -> dict
         params = dict(kwargs)
-        params.update(dict(access_token=self.access_token))
-        return self.valid_response(requests.get(url=url, params=params))
+
+        def request(token):
+            params.update(dict(access_token=token))
+            return self.valid_response(self.session.get(url=url, params=params, timeout=self.timeout))
+
+        return self._call(request)
 
     def post(self, url, data=None, json=None, **kwargs):
-        params = dict(access_token=self.access_token)
-        if data is not None:
-            return self.valid_response(requests.post(url, data, params=params, **kwargs))
-        if json is not None:
-            from json import dumps
-            data = dumps(json, encoding="utf-8", ensure_ascii=False)
-            return self.valid_response(requests.post(url, data, params=params, **kwargs))
-
-    def download(self, url, params=None, **kwargs):
-        stream = requests.get(url, params=params, stream=True, **kwargs)
-        if stream.ok:
-            return stream.raw.data
-        raise WXApiError(url)
+        kwargs.setdefault('timeout', self.timeout)
+        if data is None and json is not None:
+            data = dumps(json, ensure_ascii=False)
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+
+        def request(token):
+            params = dict(access_token=token)
+            return self.valid_response(self.session.post(url, data, params=params, **kwargs))
+
+        return self._call(request)
+
+    def download(self, url, params=None, with_token=False, dest=None, chunk_size=64 * 1024, **kwargs):
+        """
+        下载文件内容, `with_token` 为 True 时附带 access_token; 微信返回错误 JSON 时抛出 `WeChatError`
+        :param dest: 未指定时返回全部内容(bytes); 为文件对象或可写缓冲区时按 `chunk_size` 分块写入, 返回写入的字节数
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        params = dict(params or {})
+
+        def request(token):
+            if with_token:
+                params.update(dict(access_token=token))
+            stream = self.session.get(url, params=params, stream=True, **kwargs)
+            try:
+                if not stream.ok:
+                    raise WXApiError(url)
+                if stream.headers.get('Content-Type', '').startswith(('application/json', 'text/plain')):
+                    return self.valid_response(stream)
+                if dest is None:
+                    return stream.content
+                return _copy_stream(stream, dest, chunk_size)
+            finally:
+                stream.close()
+
+        return self._call(request) if with_token else request(None)
+
+    def _download_to(self, des_path, overwrite, url, params=None, with_token=False):
+        """
+        下载到 `des_path`: 先分块写入同目录下的临时文件, 完成后原子地替换目标文件, 内容不会整体读入内存
+        `des_path` 为文件对象或可写缓冲区时直接写入
+        微信返回的是没有 errcode 的 JSON(如视频素材的 video_url)时不写入文件, 返回该 dict
+        """
+        if not isinstance(des_path, (bytes, type(''))):
+            return self.download(url, params=params, with_token=with_token, dest=des_path)
+        des_path = os.path.abspath(des_path)
+        if os.path.exists(des_path) and (not overwrite):
+            logging.error("指令路径文件已存在，且未指定覆盖")
+            raise WXApiError("指令路径文件已存在，且未指定覆盖")
+        return _atomic_write(des_path, lambda f: self.download(url, params=params, with_token=with_token, dest=f),
+                             discard=lambda written: isinstance(written, dict))
+
+    def _call(self, request):
+        """以当前 access_token 调用 `request(access_token)`, 出错时按 `_after_request_error` 的判断重试"""
+        attempt = 0
+        while True:
+            token = self.access_token
+            try:
+                return request(token)
+            except WeChatError as e:
+                attempt += 1
+                if not self._after_request_error(e, attempt, token):
+                    raise
 
     def update(self, app_id, app_secret):
         self.app_id = app_id or self.app_id
@@ -70,53 +529,187 @@ class MPCenter(object):
             appid=self.app_id,
             secret=self.app_secret
         )
-        rs = requests.get(url, params=params).json()
-        expires_in = int(rs['expires_in'])
+        rs = self.session.get(url, params=params, timeout=self.timeout).json()
+        expires = int(rs['expires_in']) + time() - 60
         self.access_token_cache = rs['access_token']
-        self.access_token_date = datetime.fromtimestamp(expires_in + time() - 60)
+        self.access_token_date = datetime.fromtimestamp(expires)
+        if self.token_store is not None:
+            self.token_store.set(self.app_id, self.access_token_cache, expires)
         logging.warn("刷新access_token {0} 将于{1}过期".format(self.access_token_cache, self.access_token_date))
         return dict(rs)
 
-    @property
-    def access_token(self):
+    def _cached_token(self):
         if self.enable_cache and self.access_token_cache is not None \
                 and self.access_token_date > datetime.now():
             return self.access_token_cache
-        else:
+        return None
+
+    @property
+    def access_token(self):
+        token = self._cached_token()
+        if token is not None:
+            return token
+        with self._token_lock:
+            token = self._cached_token()  # 等待期间可能已由其他线程刷新
+            if token is None:
+                self._renew_token()
+                token = self.access_token_cache
+        return token
+
+    def _renew_token(self, ahead=0, stale=None):
+        """
+        调用方需持有 `_token_lock`; 共享存储中已有 `ahead` 秒后仍有效的 access_token 时直接采用, 否则刷新
+        :param stale: 已被微信判定失效的 access_token, 共享存储中仍是它时也要刷新
+        """
+        store = self.token_store
+        if store is None or not self.enable_cache:
             self.refresh_access_token()
-            return self.access_token
+            return
+        item = store.get_valid(self.app_id, ahead)
+        if item is None or item[0] == stale:
+            with store.lock(self.app_id):
+                item = store.get_valid(self.app_id, ahead)  # 等待期间可能已由其他进程刷新
+                if item is None or item[0] == stale:
+                    self.refresh_access_token()
+                    return
+        self.access_token_cache = item[0]
+        self.access_token_date = datetime.fromtimestamp(item[1])
+
+    def start_token_refresher(self, ahead=300):
+        """启动后台线程, 在 access_token 过期前 `ahead` 秒刷新, 使请求不必等待刷新"""
+        if self._refresher is not None:
+            return
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, args=(ahead,), name="access-token-refresher")
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def stop_token_refresher(self):
+        if self._refresher is None:
+            return
+        self._refresher_stop.set()
+        self._refresher.join()
+        self._refresher = None
+
+    def _refresh_loop(self, ahead):
+        stop = self._refresher_stop
+        while not stop.is_set():
+            expires = self.access_token_date
+            if expires is not None and self.access_token_cache is not None:
+                remaining = (expires - datetime.now()).total_seconds() - ahead
+                if remaining > 0:
+                    stop.wait(remaining)
+                    continue
+            try:
+                with self._token_lock:
+                    self._renew_token(ahead)
+            except Exception as e:
+                logging.error("后台刷新access_token失败:%s" % e)
+            stop.wait(self.MIN_REFRESH_INTERVAL)
+
+    def _after_request_error(self, error, attempt, token):
+        # type: (WeChatError, int, str) -> bool
+        """第 `attempt` 次请求失败后的处理, 需要重试时返回 True"""
+        if error.is_access_token_expires():
+            reason = 'token_expired'
+        elif error.is_system_busy():
+            reason = 'system_busy'
+        elif error.is_rate_limited():
+            reason = 'rate_limited'
+        else:
+            return False
+        if attempt > self.max_retries:
+            self._count('gave_up')
+            return False
+        self._count(reason)
+        if reason == 'token_expired':
+            with self._token_lock:
+                if self.access_token_cache == token:  # 其他线程尚未刷新
+                    self._renew_token(stale=token)
+        else:
+            self._sleep_backoff(attempt)
+        return True
+
+    def _sleep_backoff(self, attempt):
+        sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
 
-    def _after_request_error(self, error, call_back, *args):
-        if isinstance(error, WeChatError):
-            if error.is_access_token_expires():
-                self.refresh_access_token()
-                return call_back(*args)
+    def _count(self, name):
+        with self._stats_lock:
+            self.retry_counts[name] += 1
 
     def valid_response(self, res_obj):
         # type: (requests.Response) -> dict
         if res_obj.ok:
-            result = res_obj.json()
-            if 'errcode' in result:
-                if result['errcode'] == 0:
-                    return result
-                else:
-                    raise WeChatError(result)
-            return result
-        raise WXApiError("微信服务器返回异常状态:" + res_obj.status_code)
+            return _check_result(res_obj.json())
+        raise WXApiError("微信服务器返回异常状态:%d" % res_obj.status_code)
 
     def reply(self, mp_reply):
         """此接口主要用于客服等有人工消息处理环节的功能,时限48小时"""
         url = 'https://api.weixin.qq.com/cgi-bin/message/custom/send'
         try:
-            self.post(url, json=mp_reply)
+            self.post(url, json=_reply_json(mp_reply))
         except WeChatError as e:
             logging.error(e.message)
+            if e.is_invalid_media():
+                self.invalidate_media(_reply_media_id(mp_reply))
         except Exception as e:
             logging.error("客服消息回复失败")
             raise WXApiError(e)
         else:
             return True
 
+    def iter_replies(self, replies, qps=None, workers=8):
+        """
+        以 `workers` 个线程并发发送客服消息, 整体速率不超过 `qps` 次/秒(默认 `REPLY_QPS`)
+        按完成顺序产出 (openid, 异常), 成功时异常为 None; 某个用户失败不影响其他用户
+        系统繁忙、频率超限及 access_token 失效由 `max_retries` 重试, 网络错误同样按退避重试
+        :param replies: (openid, `MPReply` 或 dict) 对, 按需读取
+        """
+        url = 'https://api.weixin.qq.com/cgi-bin/message/custom/send'
+        limiter = _RateLimiter(qps or self.REPLY_QPS)
+
+        def send(item):
+            data = _reply_json(item[1], item[0])
+            attempt = 0
+            while True:
+                limiter.acquire()
+                try:
+                    return self.post(url, json=data)
+                except requests.RequestException:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        self._count('gave_up')
+                        raise
+                    self._count('network_error')
+                    self._sleep_backoff(attempt)
+
+        for item, _, error in _bounded_map(send, replies, workers):
+            if error is not None:
+                logging.error("`iter_replies` 客服消息发送失败[%s]:%s" % (item[0], error))
+                if isinstance(error, WeChatError) and error.is_invalid_media():
+                    self.invalidate_media(_reply_media_id(item[1]))
+            yield item[0], error
+
+    def send_replies(self, replies, qps=None, workers=8):
+        """
+        同 `iter_replies`, 全部发送完后返回统计
+        dict(sent, failed, elapsed, throughput, errors={openid: 异常}, retries=本次的重试次数)
+        """
+        retries = dict(self.retry_counts)
+        start = time()
+        sent = 0
+        errors = dict()
+        for openid, error in self.iter_replies(replies, qps, workers):
+            if error is None:
+                sent += 1
+            else:
+                errors[openid] = error
+        elapsed = time() - start
+        logging.info("客服消息群发完成: 成功[%d] 失败[%d] 耗时[%.1fs]" % (sent, len(errors), elapsed))
+        return dict(sent=sent, failed=len(errors), elapsed=elapsed,
+                    throughput=(sent + len(errors)) / elapsed if elapsed > 0 else 0.0, errors=errors,
+                    retries=dict((k, v - retries.get(k, 0)) for k, v in self.retry_counts.items()))
+
     def add_kf(self, account, nickname, password):
         """
         增加客服账号
@@ -136,7 +729,7 @@ class MPCenter(object):
             return True
 
     def broadcast(self):
-        """该接口不适用,服务号每月最大4次"""
+        """该接口不适用,服务号每月最大4次; 向48小时内互动过的用户群发请使用 `send_replies`"""
         pass
 
     #######################
@@ -250,6 +843,8 @@ class MPCenter(object):
         except WeChatError as e:
             logging.error(e.message)
         else:
+            if self.user_gid_cache is not None:
+                self.user_gid_cache.invalidate(openid)
             logging.info('`update_user_gid` 更改用户组成功')
 
     def get_user_gid(self, openid):
@@ -259,6 +854,11 @@ class MPCenter(object):
         :return:
         :raise WXError
         """
+        cache = self.user_gid_cache
+        if cache is not None:
+            res_obj = cache.get(openid)
+            if res_obj is not None:
+                return res_obj
         url = 'https://api.weixin.qq.com/cgi-bin/groups/getid'
         params = dict(openid=openid)
         try:
@@ -267,6 +867,8 @@ class MPCenter(object):
             logging.error(e.message)
         else:
             logging.info('`get_user_gid` 获取用户组ID成功')
+            if cache is not None:
+                cache.set(openid, res_obj)
             return res_obj
 
     def get_user_info(self, openid, language='zh_CN'):
@@ -277,6 +879,14 @@ class MPCenter(object):
         :return:
         :raise WXError
         """
+        cache = self.user_info_cache
+        if cache is not None:
+            # 以 openid 为键, 条目为 language -> (过期时间, 用户信息), 各语言的信息按各自的获取时间过期
+            item = cache.get(openid, dict(), counted=False).get(language)
+            hit = item is not None and item[0] > time()
+            cache.record(hit)
+            if hit:
+                return item[1]
         params = dict(openid=openid, lang=language)
         url = 'https://api.weixin.qq.com/cgi-bin/user/info'
         try:
@@ -285,113 +895,148 @@ class MPCenter(object):
             logging.error(e.message)
         else:
             logging.info('`get_user_info` 获取用户信息成功')
+            if cache is not None:
+                now = time()
+                languages = dict((k, v) for k, v in cache.get(openid, dict(), counted=False).items() if v[0] > now)
+                languages[language] = (now + cache.ttl, res_obj)
+                cache.set(openid, languages)
             return res_obj
 
-    def _get_user(self, url, next_openid=None):
+    def invalidate_user(self, openid):
+        """清除指定用户的信息(全部语言)及分组缓存"""
+        if self.user_info_cache is not None:
+            self.user_info_cache.invalidate(openid)
+            self.user_gid_cache.invalidate(openid)
+
+    def on_event(self, event):
+        """将收到的事件交给 `MPCenter`, 关注/取消关注时清除该用户的缓存"""
+        if isinstance(event, (SubEvent, UnSubEvent)):
+            self.invalidate_user(event.from_id)
+
+    def user_cache_stats(self):
+        """各接口缓存的命中/未命中次数及缓存数量, 未启用缓存时返回空 dict"""
+        if self.user_info_cache is None:
+            return dict()
+        return dict(user_info=self.user_info_cache.stats, user_gid=self.user_gid_cache.stats)
+
+    def iter_user_info(self, openids, language='zh_CN', workers=4):
         """
-        :param url:
-        :param next_openid:
-        :return:
+        通过批量接口(每次100个)以 `workers` 个线程并发获取用户信息, 按完成顺序逐批产出 (该批openid列表, 用户信息列表, 异常)
+        某批失败时用户信息列表为 None 并给出异常, 不影响其他批次
         """
-        try:
-            if next_openid is not None:
-                params = dict(next_openid=next_openid)
-                res_obj = self.get(url, **params)
-            else:
-                res_obj = self.get(url)
-        except WeChatError as e:
-            logging.error(e.message)
-        else:
-            return res_obj
+        url = 'https://api.weixin.qq.com/cgi-bin/user/info/batchget'
+
+        def fetch(chunk):
+            user_list = [dict(openid=openid, lang=language) for openid in chunk]
+            return self.post(url, json=dict(user_list=user_list))['user_info_list']
+
+        for chunk, infos, error in _bounded_map(fetch, _chunks(openids, 100), workers):
+            if error is not None:
+                logging.error("`iter_user_info` 批量获取用户信息失败[%s...]:%s" % (chunk[0], error))
+            yield chunk, infos, error
 
     def get_users(self):
         """获取所有关注者的openid"""
-        all_users = list()
-        url = 'https://api.weixin.qq.com/cgi-bin/user/get'
         logging.info('获取所有用户')
-        res_obj = self._get_user(url)
-
-        total = res_obj['total']
-        count = res_obj['count']
-        all_users += res_obj['data").get("openid']
-        while count != total:
-            next_openid = res_obj['next_openid']
-            if not next_openid:
-                break  # 防止死循环
-            if total != res_obj['total']:
-                logging.warning("`get_users` 获取用户总数不一致")
-                break  # 防止死循环
-            res_obj = self._get_user(url, next_openid)
-            count += res_obj['count']
-            all_users += res_obj['data").get("openid']
+        all_users = list(self.iter_users())
         logging.info("成功获取所有用户:[%d]位" % len(all_users))
         return all_users
 
+    def iter_users(self, next_openid=None, checkpoint=None, prefetch=False):
+        """
+        逐页拉取(每页最多10000个)并逐个产出关注者的openid, 出错时抛出异常
+        :param next_openid: 从该openid之后继续拉取, 用于恢复中断的遍历
+        :param checkpoint: 调用方处理完一页后以该页的 next_openid 调用, 保存下来即可在中断后恢复
+        :param prefetch: 为 True 时在调用方处理当前页的同时于后台线程拉取下一页
+        """
+        url = 'https://api.weixin.qq.com/cgi-bin/user/get'
+
+        def fetch(openid):
+            return self.get(url, next_openid=openid) if openid else self.get(url)
+
+        page = fetch(next_openid)
+        count = 0
+        while True:
+            openids = page.get('data', {}).get('openid', [])
+            following = page.get('next_openid')
+            count += len(openids)
+            more = bool(openids) and bool(following) and count < page.get('total', count + 1)
+            pending = _in_background(fetch, following) if (prefetch and more) else None
+            for openid in openids:
+                yield openid
+            if checkpoint is not None:
+                checkpoint(following)
+            if not more:
+                break
+            page = pending() if pending is not None else fetch(following)
+
     ###################
     # 多媒体管理
     ###################
-    def upload_media(self, file_path, file_type):
-        # type: (str, str) -> dict
+    def upload_media(self, media, file_type, filename=None, force=False):
+        # type: (object, str, str) -> dict
         """
         上传指定文件，成功则返回对应的 `media_id`
-        :param file_path: 
+        文件内容以流的方式分块发送, 格式根据文件头识别而不是后缀
+        :param media: 文件路径、文件对象(包括 mmap) 或 bytes/bytearray/memoryview
         :param file_type: 'image' 'thumb', 'voice', 'video'
+        :param filename: 上传时使用的文件名, 默认取路径/文件对象的文件名
+        :param force: 为 True 时忽略 `media_cache` 中的 media_id 重新上传
         :return: `None` if failed else dict
         """
-        url = 'http://file.api.weixin.qq.com/cgi-bin/media/upload' + '&type='
-        if not os.path.exists(file_path):
-            logging.error("uploadMedia指定的文件不存在[%s]" % file_path)
-            raise WXApiError("指定路径文件不存在")
-        if file_path.endswith('jpg') and file_type == 'image':
-            if os.path.getsize(file_path) > 128 * 1024:
-                logging.error("上传Image文件最大为128KB")
-                raise WXApiError("Image文件最大128KB")
-        elif file_path.endswith('jpg') and file_type == 'thumb':
-            if os.path.getsize(file_path) > 64 * 1024:
-                logging.error("上传thumb文件最大为64KB")
-                raise WXApiError("thumb文件最大64KB")
-        elif (file_path.endswith('amr') or file_path.endswith('mp3')) and file_type == 'voice':
-            if os.path.getsize(file_path) > 256 * 1024:
-                logging.error("voice文件最大256KB")
-                raise WXApiError("voice文件最大256KB")
-        elif file_path.endswith('mp4') and file_type == 'video':
-            if os.path.getsize(file_path) > 1 * 1024 * 1024:
-                logging.error("Video文件最大1MB")
-                raise WXApiError("Video文件最大1MB")
-        else:
-            logging.error("指定的文件类型不支持上传")
-            raise WXApiError("不支持的文件类型或格式")
-        url += file_type
-        try:
-            res_obj = self.post(url, files={'image': (open(file_path, 'rb'))})
-        except WeChatError as e:
-            logging.error("上传文件失败")
-            logging.error(e.message)
-        else:
-            logging.info('uploadMedia上传文件成功,media_id:[%s]' % res_obj['media_id'])
-            return res_obj
+        url = 'http://file.api.weixin.qq.com/cgi-bin/media/upload'
+        with _MediaSource(media, filename) as source:
+            fmt, mime = _check_media(source.head(), source.size, file_type)
+            digest = None
+            if self.media_cache is not None:
+                digest = source.digest()
+                res_obj = None if force else self.media_cache.get(file_type, digest)
+                if res_obj is not None:
+                    logging.info('uploadMedia内容已上传过,复用media_id:[%s]' % res_obj['media_id'])
+                    return res_obj
+            name = source.name if os.path.splitext(source.name)[1] else '%s.%s' % (source.name, fmt)
+
+            def request(token):
+                body = _MultipartBody('media', name, mime, source.reader(), source.size)
+                params = dict(access_token=token, type=file_type)
+                headers = {'Content-Type': body.content_type}
+                return self.valid_response(self.session.post(url, data=body, params=params, headers=headers,
+                                                             timeout=self.timeout))
+
+            try:
+                res_obj = self._call(request)
+            except WeChatError as e:
+                logging.error("上传文件失败")
+                logging.error(e.message)
+                return None
+        logging.info('uploadMedia上传文件成功,media_id:[%s]' % res_obj['media_id'])
+        if digest is not None:
+            self.media_cache.set(file_type, digest, res_obj['media_id'], res_obj.get('created_at'))
+        return res_obj
+
+    def invalidate_media(self, media_id):
+        """从 `media_cache` 中删除 `media_id`, 之后相同内容会重新上传; 微信返回 media_id 不合法(40007)时调用"""
+        if self.media_cache is not None and media_id:
+            self.media_cache.invalidate(media_id)
 
     def download_media(self, media_id, des_path, overwrite=False):
         # type: (str, str, bool) -> bool
         """
         下载指定的 `media_id` 并存储
         :param media_id: 
-        :param des_path: 
+        :param des_path: 保存路径, 也可以是文件对象或可写缓冲区
         :param overwrite: 
-        :return: 
+        :return: 成功返回 True; 微信返回的不是文件(如视频素材的 video_url)时不写入, 返回该 JSON(dict)
         """
-        if os.path.exists(os.path.abspath(des_path)) and (not overwrite):
-            logging.error("指令路径文件已存在，且未指定覆盖")
-            raise WXApiError("指令路径文件已存在，且未指定覆盖")
         url = 'http://file.api.weixin.qq.com/cgi-bin/media/get'
         params = dict(media_id=media_id)
         try:
-            bin_data = self.download(url, params=params)
+            written = self._download_to(des_path, overwrite, url, params=params, with_token=True)
         except WeChatError as e:
             logging.error(e.message)
         else:
-            with open(des_path, 'wb') as f:
-                f.write(bin_data)
+            if isinstance(written, dict):
+                return written
             logging.info("文件下载保存成功")
             return True
 
@@ -404,66 +1049,69 @@ class MPCenter(object):
         如果指定的时间超过该限制或者给定的场景值是字符串则使用永久的ID
         action_name QR_SCENE QR_LIMIT_SCENE QR_LIMIT_STR_SCENE
         """
-        url = 'https://api.weixin.qq.com/cgi-bin/qrcode/create'
-        if expire_seconds <= 2592000 and type(scene_value) is int:
-            params = {
-                "action_name": "QR_SCENE",
-                "action_info": {
-                    "scene": {
-                        "scene_str": "123"
-                    }
-                }
-            }
-        else:
-            if type(scene_value) is int:
-                if scene_value not in range(1, 100001):
-                    raise WeChatError("微信服务器要求给定的场景编号不超过 100000")
-                params = {
-                    "action_name": "QR_LIMIT_SCENE",
-                    "action_info": {
-                        "scene": {
-                            "scene_id": scene_value
-                        }
-                    }
-                }
-            else:
-                if len(scene_value) > 64:
-                    raise WeChatError("微信服务器要求给定的场景标志不超过64个英文字符")
-                params = {
-                    "action_name": "QR_LIMIT_STR_SCENE",
-                    "action_info": {
-                        "scene": {
-                            "scene_str": str(scene_value)
-                        }
-                    }
-                }
         try:
-            if params is not None:
-                res_obj = self.post(url, json=params)
-            else:
-                raise WXApiError("没有指定二维码参数")
+            res_obj = self._create_qrcode_ticket(scene_value, expire_seconds)
         except WeChatError as e:
             logging.error("创建二维码出错")
             logging.error(e.message)
         else:
-            ticket = quote(res_obj['ticket'])  # 创建二维码ticket
-            url = 'https://mp.weixin.qq.com/cgi-bin/showqrcode?ticket=' + ticket
             # 凭借ticket到指定URL换取二维码,返回地址,自行决定是分发URL还是下载
-            return url
+            return _qrcode_url(res_obj['ticket'])
+
+    def _create_qrcode_ticket(self, scene_value, expire_seconds):
+        url = 'https://api.weixin.qq.com/cgi-bin/qrcode/create'
+        return self.post(url, json=_qrcode_params(scene_value, expire_seconds))
+
+    def iter_qrcodes(self, scene_values, expire_seconds=2592000, des_dir=None, manifest=None, workers=8):
+        """
+        以 `workers` 个线程并发创建二维码, 按完成顺序逐个产出记录
+        dict(scene, ticket, url, expires_at, path, error); 某个场景失败时 error 为错误信息, 不影响其他场景
+        :param scene_values: 场景值, 按需读取, 参数同 `create_qrcode`
+        :param des_dir: 指定时同时下载二维码图片到该目录, 文件名为 quote 后的场景值加 .jpg
+        :param manifest: 清单文件路径, 每条记录完成后以 JSON 行追加写入;
+                         再次运行时跳过清单中已成功且未过期(图片仍存在)的场景, 只重做失败或未完成的
+        """
+        done = _load_qrcode_manifest(manifest, des_dir) if manifest else set()
+
+        def make(scene_value):
+            res_obj = self._create_qrcode_ticket(scene_value, expire_seconds)
+            record = dict(scene=scene_value, ticket=res_obj['ticket'], url=_qrcode_url(res_obj['ticket']),
+                          expires_at=int(time()) + res_obj['expire_seconds'] if 'expire_seconds' in res_obj else None,
+                          path=None, error=None)
+            if des_dir is not None:
+                path = os.path.join(des_dir, quote(str(scene_value), safe='') + '.jpg')
+                if isinstance(self._download_to(path, True, record['url']), dict):
+                    raise WXApiError("二维码地址返回的不是图片")
+                record['path'] = path
+            return record
+
+        out = open(manifest, 'ab') if manifest else None
+        try:
+            pending = (scene_value for scene_value in scene_values if scene_value not in done)
+            for scene_value, record, error in _bounded_map(make, pending, workers):
+                if error is not None:
+                    logging.error("`iter_qrcodes` 创建二维码失败[%s]:%s" % (scene_value, error))
+                    record = dict(scene=scene_value, ticket=None, url=None, expires_at=None, path=None,
+                                  error=getattr(error, 'errorEnMsg', None) or getattr(error, 'errorMsg', None)
+                                  or repr(error))
+                if out is not None:
+                    out.write(dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+                    out.flush()
+                yield record
+        finally:
+            if out is not None:
+                out.close()
 
     def save_qrcode(self, des_path, qr_url, overwrite=True):
         # type: (str, str, bool) -> bool
-        """将指定的二维码url保存到本地,失败/出错 抛出异常 WXError WeChatError IOError"""
-        if os.path.exists(os.path.abspath(des_path)) and (not overwrite):
-            logging.error("指令路径文件已存在，且未指定覆盖")
-            raise WXApiError("指令路径文件已存在，且未指定覆盖")
+        """将指定的二维码url保存到本地(`des_path` 也可以是文件对象或可写缓冲区),失败/出错 抛出异常 WXError WeChatError IOError"""
         try:
-            bin_data = self.download(qr_url)
+            written = self._download_to(des_path, overwrite, qr_url)
         except WeChatError as e:
             logging.error("上传文件时出错")
             logging.error(e.message)
         else:
-            with open(des_path, 'wb') as f:
-                f.write(bin_data)
+            if isinstance(written, dict):
+                raise WXApiError("二维码地址返回的不是图片")
             logging.info("文件下载保存成功")
             return True
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+access_token 的共享存储, 多进程/多机部署时所有 `MPCenter` 共用一个 access_token, 且同一时间只有一个刷新者
+实现其他后端(如 Redis)时继承 `TokenStore` 并实现 `get` `set` `lock` 三个方法
+"""
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .WXError import WXApiError
+
+__all__ = ['TokenStore', 'MemoryTokenStore', 'FileTokenStore']
+
+
+class TokenStore(object):
+    """access_token 存储接口"""
+
+    def get(self, app_id):
+        # type: (str) -> tuple
+        """返回 (access_token, 过期时间戳), 不存在返回 None"""
+        raise NotImplementedError
+
+    def set(self, app_id, token, expires):
+        # type: (str, str, float) -> None
+        raise NotImplementedError
+
+    def lock(self, app_id):
+        """返回上下文管理器, 持有期间其他使用者无法刷新同一 `app_id` 的 access_token"""
+        raise NotImplementedError
+
+    def get_valid(self, app_id, ahead=0):
+        # type: (str, int) -> tuple
+        """返回在 `ahead` 秒后仍有效的 (access_token, 过期时间戳), 否则返回 None"""
+        item = self.get(app_id)
+        if item is not None and item[1] > time() + ahead:
+            return item
+        return None
+
+
+class MemoryTokenStore(TokenStore):
+    """进程内存储, 供同一进程内多个 `MPCenter` 共享"""
+
+    def __init__(self):
+        self._tokens = dict()
+        self._locks = dict()
+        self._guard = threading.Lock()
+
+    def get(self, app_id):
+        return self._tokens.get(app_id)
+
+    def set(self, app_id, token, expires):
+        self._tokens[app_id] = (token, expires)
+
+    def lock(self, app_id):
+        with self._guard:
+            return self._locks.setdefault(app_id, threading.Lock())
+
+
+class FileTokenStore(TokenStore):
+    """
+    基于本地文件的存储, 同一主机上的多个进程共享, 以 `fcntl.flock` 加锁, 读取时映射(mmap)文件
+    :param path: 数据文件路径, 刷新锁使用 `path + '.lock'`
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise WXApiError("FileTokenStore 需要 fcntl 支持")
+        self.path = path
+        self.lock_path = path + '.lock'
+        with open(self.path, 'ab'):
+            pass
+
+    def get(self, app_id):
+        with open(self.path, 'rb') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            try:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    tokens = json.loads(data[:].decode('utf-8'))
+                finally:
+                    data.close()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        item = tokens.get(app_id)
+        return None if item is None else tuple(item)
+
+    def set(self, app_id, token, expires):
+        with open(self.path, 'r+b') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                tokens = json.loads(content.decode('utf-8')) if content else dict()
+                tokens[app_id] = [token, expires]
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(tokens).encode('utf-8'))
+                f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def lock(self, app_id):
+        # 每次重新打开文件, fork 出的子进程之间以及同一进程内的线程之间都互斥
+        with open(self.lock_path, 'ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+"""
+处理微信回调的 WSGI 应用: 校验签名 -> (解密) -> xml2event -> (去重) -> 按事件类分发到处理函数 -> render 回复
+可在任意 WSGI 服务器下运行, ASGI 版本见 `ASGIWebhookApp`(需要 Python 3.5+)
+"""
+import logging
+
+from .WXError import WXApiError
+from .WXUtils import (SignatureVerifier, parse_callback_query, xml2event)
+
+__all__ = ['WebhookApp']
+
+_STATUS = {200: '200 OK', 400: '400 Bad Request', 401: '401 Unauthorized', 405: '405 Method Not Allowed',
+           413: '413 Request Entity Too Large'}
+_SUCCESS = b'success'
+
+
+class WebhookApp(object):
+    """
+    微信回调的 WSGI 应用, 以 `register` 为消息/事件类注册处理函数 `handler(msg) -> ReplyObject`
+    分发时按消息对象的类及其父类依次查找, 未找到时使用 `default`(默认不回复)
+    处理函数出错、返回 None 或消息无法解析时回复 "success", 避免微信重试
+    :param token: 公众号后台配置的 Token
+    :param crypto: `MessageCrypto`, 指定时处理安全模式(encrypt_type=aes)的加密报文
+    :param dedup: `DedupStore`, 指定时丢弃微信重试推送的重复消息
+    :param replier: `DeferredReplier`, 指定时超出时限的处理函数先回复 "success", 完成后以客服消息发送
+    :param lazy: 传给 `xml2event`, 字段在首次访问时才解析
+    :param max_body: 请求体的最大字节数
+    """
+
+    def __init__(self, token, crypto=None, dedup=None, replier=None, lazy=True, max_body=64 * 1024,
+                 default=None):
+        self.verifier = SignatureVerifier(token)
+        self.crypto = crypto
+        self.dedup = dedup
+        self.replier = replier
+        self.lazy = lazy
+        self.max_body = max_body
+        self.default = default
+        self._handlers = dict()  # 注册的类 -> 处理函数
+        self._resolved = dict()  # 消息类 -> 处理函数, 按 MRO 查找的结果
+
+    def register(self, event_class, handler=None):
+        """为 `event_class` 注册处理函数, 可作为装饰器使用: `@app.register(TextMsg)`"""
+        def decorator(func):
+            self._handlers[event_class] = func
+            self._resolved.clear()
+            return func
+
+        return decorator if handler is None else decorator(handler)
+
+    def handler_for(self, event_class):
+        """按 `event_class` 的 MRO 查找处理函数, 结果按类缓存"""
+        try:
+            return self._resolved[event_class]
+        except KeyError:
+            pass
+        handler = self.default
+        for klass in event_class.__mro__:
+            if klass in self._handlers:
+                handler = self._handlers[klass]
+                break
+        self._resolved[event_class] = handler
+        return handler
+
+    def handle(self, method, query, body):
+        # type: (str, bytes, bytes) -> tuple
+        """处理一次回调, 返回 (HTTP 状态码, 响应 bytes), 与具体的 WSGI/ASGI 服务器无关"""
+        args = parse_callback_query(query)
+        if not self.verifier(args):
+            return 401, b''
+        encrypted = self.crypto is not None and args.get('encrypt_type') == 'aes'
+        if method == 'GET':
+            try:
+                echostr = self.crypto.decrypt_echostr(args) if encrypted else args.get('echostr', '')
+            except WXApiError:
+                return 401, b''
+            return 200, echostr if isinstance(echostr, bytes) else echostr.encode('utf-8')
+        if method != 'POST':
+            return 405, b''
+        # 报文不合法(缺少字段、无法解密等)或去重存储出错时同样回复 "success", 避免微信重试
+        try:
+            msg = xml2event(self.crypto.decrypt_message(args, body) if encrypted else body, lazy=self.lazy)
+            duplicate = self.dedup is not None and self.dedup.is_duplicate(msg)
+        except WXApiError:
+            return 200, _SUCCESS
+        except Exception:
+            logging.exception("消息解析或去重失败")
+            return 200, _SUCCESS
+        if duplicate:
+            logging.info("丢弃重复推送的消息[%s]" % msg.from_id)
+            return 200, _SUCCESS
+        handler = self.handler_for(type(msg))
+        if handler is None:
+            return 200, _SUCCESS
+        try:
+            reply = self.replier(handler, msg) if self.replier is not None else handler(msg)
+        except Exception:
+            logging.exception("处理函数出错[%s]" % msg.from_id)
+            return 200, _SUCCESS
+        if reply is None:
+            return 200, _SUCCESS
+        if encrypted:
+            return 200, self.crypto.encrypt_reply(reply, args['nonce'])
+        return 200, reply.render()
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        body = b''
+        if method == 'POST':
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = -1
+            if length < 0 or length > self.max_body:
+                return self._respond(start_response, 413 if length > 0 else 400, b'')
+            body = environ['wsgi.input'].read(length) if length else b''
+        status, data = self.handle(method, environ.get('QUERY_STRING', '').encode('latin-1'), body)
+        return self._respond(start_response, status, data)
+
+    @staticmethod
+    def _respond(start_response, status, data):
+        start_response(str(_STATUS[status]), [(str('Content-Type'), str('text/xml; charset=utf-8')),
+                                              (str('Content-Length'), str(len(data)))])
+        return [data]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+安全模式加解密: 复用的 `MessageCrypto` 完成 解密推送报文 -> 解析事件 -> 生成并加密回复 的完整往返每秒次数
+对比每次请求都重新创建 `MessageCrypto`(重复解码 EncodingAESKey 及密钥扩展)的情况
+python benchmarks/bench_crypto.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import (MessageCrypto, TextReply, xml2event)
+from WXApi.WXUtils import xml2json
+
+TOKEN = 'QDG6eK'
+AES_KEY = 'jWmYm7qr5nMoAUwZRjGtBxmz3KA1tkAj3ykkR6q2B2C'
+APP_ID = 'wx5823bf96d3bd56c7'
+TIMESTAMP = '1409304348'
+NONCE = '1500937196'
+TEXT_XML = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+            '<FromUserName><![CDATA[oia2TjjewbmiOUlr6X-1crbLOvLw]]></FromUserName>'
+            '<CreateTime>1348831860</CreateTime><MsgType><![CDATA[text]]></MsgType>'
+            '<Content><![CDATA[this is a test]]></Content><MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+
+
+def encrypted_request(crypto):
+    encrypt = crypto.encrypt(TEXT_XML)
+    body = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+            '<Encrypt><![CDATA[%s]]></Encrypt></xml>' % encrypt).encode('utf-8')
+    args = dict(timestamp=TIMESTAMP, nonce=NONCE, msg_signature=crypto.signature(TIMESTAMP, NONCE, encrypt))
+    return args, body
+
+
+def round_trip(crypto, args, body):
+    msg = xml2event(crypto.decrypt_message(args, body))
+    return crypto.encrypt_reply(TextReply(msg, msg.content), args['nonce'], TIMESTAMP)
+
+
+def main(number=20000):
+    crypto = MessageCrypto(TOKEN, AES_KEY, APP_ID)
+    args, body = encrypted_request(crypto)
+    reply = round_trip(crypto, args, body)
+    reply_args = dict(timestamp=TIMESTAMP, nonce=NONCE, msg_signature=xml2json(reply)['MsgSignature'])
+    assert b'this is a test' in crypto.decrypt_message(reply_args, reply)
+
+    fresh = min(timeit.repeat(lambda: round_trip(MessageCrypto(TOKEN, AES_KEY, APP_ID), args, body),
+                              number=number, repeat=3))
+    reused = min(timeit.repeat(lambda: round_trip(crypto, args, body), number=number, repeat=3))
+    print("round trip  new crypto per request {0:>8.0f}/s  reused {1:>8.0f}/s".format(
+        number / fresh, number / reused))
+    decrypt = min(timeit.repeat(lambda: crypto.decrypt_message(args, body), number=number, repeat=3))
+    print("decrypt only                        {0:>8.0f}/s".format(number / decrypt))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+`__slots__` 事件对象与原先基于 `__dict__` 的对象的内存占用与构造耗时对比
+python benchmarks/bench_event_slots.py
+"""
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import TextMsg, ClickEvent
+
+
+class LegacyObject(object):
+    """改造前的 `WeChatObject`, 字段存放于实例 `__dict__`"""
+
+    def __init__(self, msg):
+        super(LegacyObject, self).__init__()
+        self.from_id = msg['FromUserName']
+        self.to_id = msg['ToUserName']
+        self.time = msg['CreateTime']
+
+
+class LegacyMsg(LegacyObject):
+    def __init__(self, msg):
+        super(LegacyMsg, self).__init__(msg)
+        self.type = msg['MsgType'].lower()
+        self.message_id = msg['MsgId']
+
+
+class LegacyEvent(LegacyObject):
+    def __init__(self, msg):
+        super(LegacyEvent, self).__init__(msg)
+        assert msg['MsgType'] == 'event', "不是事件类型"
+        self.event = msg['Event'].lower()
+
+
+class LegacyTextMsg(LegacyMsg):
+    def __init__(self, msg):
+        super(LegacyTextMsg, self).__init__(msg)
+        assert self.type == 'text', "消息不是文本类型消息"
+        self.content = msg['Content']
+
+
+class LegacyClickEvent(LegacyEvent):
+    def __init__(self, msg):
+        super(LegacyClickEvent, self).__init__(msg)
+        assert self.event == 'click', "不是点击事件"
+        self.event_key = msg['EventKey']
+
+
+TEXT = dict(ToUserName='gh_123456789abc', FromUserName='oUpF8uMuAJO_M2pxb1Q9zNjWeS6o', CreateTime='1348831860',
+            MsgType='text', Content='hello', MsgId='1234567890123456')
+CLICK = dict(ToUserName='gh_123456789abc', FromUserName='oUpF8uMuAJO_M2pxb1Q9zNjWeS6o', CreateTime='1348831860',
+             MsgType='event', Event='CLICK', EventKey='EVENTKEY')
+
+
+def per_object_bytes(cls, msg, count=100000):
+    gc.collect()
+    tracemalloc.start()
+    objects = [cls(msg) for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return float(size) / count
+
+
+def main(number=200000):
+    for slotted, legacy, msg in ((TextMsg, LegacyTextMsg, TEXT), (ClickEvent, LegacyClickEvent, CLICK)):
+        new_time = min(timeit.repeat(lambda: slotted(msg), number=number, repeat=3)) / number * 1e6
+        old_time = min(timeit.repeat(lambda: legacy(msg), number=number, repeat=3)) / number * 1e6
+        print("{0:<12} memory {1:>6.1f}B -> {2:>6.1f}B  construct {3:.2f}us -> {4:.2f}us".format(
+            slotted.__name__, per_object_bytes(legacy, msg), per_object_bytes(slotted, msg), old_time, new_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+回调 URL 参数解析: `parse_callback_query` 与 `url_decode` 在普通/安全模式/格式错误请求下的耗时
+python benchmarks/bench_query.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import (parse_callback_query, url_decode)
+
+CASES = {
+    'plain': b'signature=c61f3c2dd2e1b6c2cbd4d4a3a1c6d8f1d4f6e9a0&timestamp=1409304348&nonce=1500937196'
+             b'&openid=oia2TjjewbmiOUlr6X-1crbLOvLw',
+    'aes': b'signature=c61f3c2dd2e1b6c2cbd4d4a3a1c6d8f1d4f6e9a0&timestamp=1409304348&nonce=1500937196'
+           b'&openid=oia2TjjewbmiOUlr6X-1crbLOvLw&encrypt_type=aes'
+           b'&msg_signature=5d197aaffba7e9b25a30732f161a50dee96bd5fa',
+    'echostr': b'signature=c61f3c2dd2e1b6c2cbd4d4a3a1c6d8f1d4f6e9a0&echostr=U2FsdGVk%2BX1%2F8%3D'
+               b'&timestamp=1409304348&nonce=1500937196',
+    'malformed': b'signature&timestamp=1409304348&&nonce',
+}
+
+
+def main(number=100000):
+    logging.disable(logging.CRITICAL)
+    for name in ('plain', 'aes', 'echostr', 'malformed'):
+        query = CASES[name]
+        fields = parse_callback_query(query)
+        assert all(url_decode(query)[key] == value for key, value in fields.items())
+        old = min(timeit.repeat(lambda: url_decode(query), number=number, repeat=3))
+        new = min(timeit.repeat(lambda: parse_callback_query(query), number=number, repeat=3))
+        print("{0:<10} url_decode {1:>6.2f}us  parse_callback_query {2:>6.2f}us  x{3:.2f}".format(
+            name, old / number * 1e6, new / number * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+回复报文: 预编译模板 `render` 与 `create_xml` 的耗时对比
+python benchmarks/bench_reply_render.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import (TextMsg, EmptyReply, TextReply, ImageReply, VoiceReply, VideoReply, MusicReply, NewsReply)
+
+SENDER = TextMsg(dict(ToUserName='gh_123456789abc', FromUserName='oUpF8uMuAJO_M2pxb1Q9zNjWeS6o',
+                      CreateTime='1348831860', MsgType='text', Content='hello', MsgId='1234567890123456'))
+
+
+def replies():
+    news = NewsReply(SENDER, '标题', '描述', 'http://example.com/a.jpg', 'http://example.com/a')
+    for i in range(3):
+        news.add_more_news('标题%d' % i, '描述', 'http://example.com/b.jpg', 'http://example.com/b')
+    return [
+        EmptyReply(SENDER),
+        TextReply(SENDER, '欢迎关注'),
+        ImageReply(SENDER, 'MEDIA_ID'),
+        VoiceReply(SENDER, 'MEDIA_ID'),
+        VideoReply(SENDER, 'MEDIA_ID', '标题', '描述'),
+        MusicReply(SENDER, '标题', '描述', 'http://example.com/a.mp3', 'http://example.com/hq.mp3', 'THUMB_ID'),
+        news,
+    ]
+
+
+def non_text_replies():
+    """字段为 int/float/bool 等非文本值时 `render` 与 `create_xml` 的结果同样一致"""
+    news = NewsReply(SENDER, 1, 2.5, 'http://example.com/a.jpg', 'http://example.com/a')
+    news.add_more_news('标题', 3, 'http://example.com/b.jpg', 'http://example.com/b')
+    return [
+        TextReply(SENDER, 5),
+        TextReply(SENDER, 2.5),
+        ImageReply(SENDER, 12345),
+        VideoReply(SENDER, 'MEDIA_ID', 1, True),
+        MusicReply(SENDER, '标题', 0, 'http://example.com/a.mp3', 1.0, 'THUMB_ID'),
+        news,
+    ]
+
+
+def main(number=20000):
+    for reply in non_text_replies():
+        assert reply.render() == reply.create_xml().encode('utf-8'), type(reply).__name__
+    for reply in replies():
+        assert reply.render() == reply.create_xml().encode('utf-8'), type(reply).__name__
+        old = min(timeit.repeat(lambda: reply.create_xml().encode('utf-8'), number=number, repeat=3))
+        new = min(timeit.repeat(reply.render, number=number, repeat=3))
+        print("{0:<12} create_xml {1:>8.2f}us  render {2:>8.2f}us  x{3:.2f}".format(
+            type(reply).__name__, old / number * 1e6, new / number * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
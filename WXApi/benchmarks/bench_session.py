@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""
+`MPCenter` 复用连接池与每次调用 `requests.get` 新建连接的单次请求耗时对比
+python benchmarks/bench_session.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import MPCenter
+from fake_server import start_server
+
+
+def per_call(func, number):
+    begin = time.time()
+    for _ in range(number):
+        func()
+    return (time.time() - begin) / number * 1e3
+
+
+def main(number=1000):
+    server, base_url = start_server()
+    url = base_url + '/cgi-bin/menu/get'
+    params = dict(access_token='ACCESS_TOKEN')
+    try:
+        old = per_call(lambda: requests.get(url, params=params).json(), number)
+        with MPCenter('APPID', 'SECRET', token='ACCESS_TOKEN', expires=time.time() + 7200) as center:
+            center.get(url)  # 预热连接
+            new = per_call(lambda: center.get(url), number)
+        print("requests.get {0:.3f}ms/call  MPCenter session {1:.3f}ms/call  x{2:.2f}".format(old, new, old / new))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+请求签名校验: 复用的 `SignatureVerifier` 与 `auth_signature` 在合法/非法/格式错误请求下的耗时
+python benchmarks/bench_signature.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import timeit
+from hashlib import sha1
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import (auth_signature, SignatureVerifier)
+
+TOKEN = 'wechatrequest'
+TIMESTAMP = '1409304348'
+NONCE = '1500937196'
+SIGNATURE = sha1(''.join(sorted([TOKEN, TIMESTAMP, NONCE])).encode('utf-8')).hexdigest()
+
+CASES = {
+    'valid': dict(signature=SIGNATURE, timestamp=TIMESTAMP, nonce=NONCE),
+    'invalid': dict(signature='0' * 40, timestamp=TIMESTAMP, nonce=NONCE),
+    'malformed': dict(signature='not-a-hex-signature', timestamp=TIMESTAMP),
+}
+
+
+def main(number=50000):
+    verifier = SignatureVerifier(TOKEN)
+    for name in ('valid', 'invalid', 'malformed'):
+        args = CASES[name]
+        assert verifier(args) == auth_signature(TOKEN, args) == (name == 'valid')
+        old = min(timeit.repeat(lambda: auth_signature(TOKEN, args), number=number, repeat=3))
+        new = min(timeit.repeat(lambda: verifier(args), number=number, repeat=3))
+        print("{0:<10} auth_signature {1:>6.2f}us  verifier {2:>6.2f}us".format(
+            name, old / number * 1e6, new / number * 1e6))
+
+    replay = SignatureVerifier(TOKEN, replay_cache_size=10000)
+    requests = [dict(signature=sha1(''.join(sorted([TOKEN, TIMESTAMP, str(i)])).encode('utf-8')).hexdigest(),
+                     timestamp=TIMESTAMP, nonce=str(i)) for i in range(number)]
+    elapsed = timeit.timeit(lambda: [replay(args) for args in requests], number=1)
+    assert not replay(requests[-1])
+    print("{0:<10} verifier+replay cache {1:>6.2f}us".format('valid', elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
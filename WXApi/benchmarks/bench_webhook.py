@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+`WebhookApp` 的回调处理吞吐:
+1. 进程内直接调用 WSGI 应用, 对比 README 中 url_decode -> auth_signature -> xml2event -> create_xml 的写法
+2. 在本地多线程 WSGI 服务器下运行, 由多个保持连接的客户端线程并发发送签名后的回调(负载生成器)
+python benchmarks/bench_webhook.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import socket
+import sys
+import threading
+import time
+from hashlib import sha1
+from wsgiref.simple_server import (WSGIServer, WSGIRequestHandler, make_server)
+
+try:
+    from http.client import HTTPConnection
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from httplib import HTTPConnection
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import (WebhookApp, TextMsg, TextReply, auth_signature, url_decode, xml2event)
+
+TOKEN = 'wechatrequest'
+TIMESTAMP = '1409304348'
+NONCE = '1500937196'
+QUERY = 'signature=%s&timestamp=%s&nonce=%s' % (
+    sha1(''.join(sorted([TOKEN, TIMESTAMP, NONCE])).encode('utf-8')).hexdigest(), TIMESTAMP, NONCE)
+BODY = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+        '<FromUserName><![CDATA[oia2TjjewbmiOUlr6X-1crbLOvLw]]></FromUserName>'
+        '<CreateTime>1348831860</CreateTime><MsgType><![CDATA[text]]></MsgType>'
+        '<Content><![CDATA[this is a test]]></Content><MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+
+
+def echo(msg):
+    return TextReply(msg, msg.content)
+
+
+def readme_glue(query, body):
+    query = url_decode(query)
+    if not auth_signature(TOKEN, query):
+        return b''
+    return (echo(xml2event(body)).create_xml() + "").encode('utf-8')
+
+
+def in_process(app, number):
+    environ = {'REQUEST_METHOD': 'POST', 'QUERY_STRING': QUERY, 'CONTENT_LENGTH': str(len(BODY))}
+
+    def call():
+        environ['wsgi.input'] = io.BytesIO(BODY)
+        return app(environ, lambda status, headers: None)[0]
+
+    assert b'this is a test' in call() and b'this is a test' in readme_glue(QUERY.encode('utf-8'), BODY)
+    begin = time.time()
+    for _ in range(number):
+        readme_glue(QUERY.encode('utf-8'), BODY)
+    old = time.time() - begin
+    begin = time.time()
+    for _ in range(number):
+        call()
+    new = time.time() - begin
+    print("in process  README glue {0:>8.0f}/s  WebhookApp {1:>8.0f}/s".format(number / old, number / new))
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 保持连接
+
+    def setup(self):
+        WSGIRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+
+def load(port, clients, number):
+    """`clients` 个线程各自保持一个连接, 共发送 `number` 个回调, 返回每秒请求数"""
+    path = '/wechat?' + QUERY
+    headers = {'Content-Type': 'text/xml'}
+
+    def client(count):
+        conn = HTTPConnection('127.0.0.1', port)
+        for _ in range(count):
+            conn.request('POST', path, BODY, headers)
+            response = conn.getresponse()
+            assert response.status == 200 and b'this is a test' in response.read()
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(number // clients,)) for _ in range(clients)]
+    begin = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return number // clients * clients / (time.time() - begin)
+
+
+def main(number=20000, clients=8):
+    app = WebhookApp(TOKEN)
+    app.register(TextMsg, echo)
+    in_process(app, number)
+
+    server = make_server('127.0.0.1', 0, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever).start()
+    try:
+        rate = load(server.server_port, clients, number // 4)
+        print("wsgiref     {0} clients             {1:>8.0f}/s".format(clients, rate))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+`xml2json` 快速解析与 ElementTree 解析的耗时对比
+python benchmarks/bench_xml2json.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from WXApi import WXUtils
+
+SAMPLES = {
+    'text': b'<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>\n'
+            b'<FromUserName><![CDATA[oUpF8uMuAJO_M2pxb1Q9zNjWeS6o]]></FromUserName>\n'
+            b'<CreateTime>1348831860</CreateTime>\n'
+            b'<MsgType><![CDATA[text]]></MsgType>\n'
+            b'<Content><![CDATA[\xe4\xbd\xa0\xe5\xa5\xbd, this is a test]]></Content>\n'
+            b'<MsgId>1234567890123456</MsgId>\n</xml>',
+    'subscribe': b'<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>\n'
+                 b'<FromUserName><![CDATA[oUpF8uMuAJO_M2pxb1Q9zNjWeS6o]]></FromUserName>\n'
+                 b'<CreateTime>123456789</CreateTime>\n'
+                 b'<MsgType><![CDATA[event]]></MsgType>\n'
+                 b'<Event><![CDATA[subscribe]]></Event>\n</xml>',
+    'click': b'<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>\n'
+             b'<FromUserName><![CDATA[oUpF8uMuAJO_M2pxb1Q9zNjWeS6o]]></FromUserName>\n'
+             b'<CreateTime>123456789</CreateTime>\n'
+             b'<MsgType><![CDATA[event]]></MsgType>\n'
+             b'<Event><![CDATA[CLICK]]></Event>\n'
+             b'<EventKey><![CDATA[EVENTKEY]]></EventKey>\n</xml>',
+}
+
+
+def etree_xml2json(xml_data):
+    result = dict()
+    for node in WXUtils.fromstring(xml_data):
+        result.update({node.tag: node.text})
+    return result
+
+
+def main(number=20000):
+    for name, data in sorted(SAMPLES.items()):
+        assert WXUtils.xml2json(data) == etree_xml2json(data), name
+        fast = min(timeit.repeat(lambda: WXUtils.xml2json(data), number=number, repeat=3))
+        slow = min(timeit.repeat(lambda: etree_xml2json(data), number=number, repeat=3))
+        print("{0:<10} ElementTree {1:>8.2f}us  flat {2:>8.2f}us  x{3:.2f}".format(
+            name, slow / number * 1e6, fast / number * 1e6, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
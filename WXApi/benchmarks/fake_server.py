@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的微信接口服务器, 供基准测试使用(HTTP/1.1, 支持长连接)
+"""
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class FakeWeChatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = {}  # path -> callable(handler, query, body) 返回 dict 或 bytes
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        route = self.routes.get(parts.path)
+        result = route(self, parse_qs(parts.query), body) if route else dict(errcode=0, errmsg='ok')
+        data = result if isinstance(result, bytes) else json.dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream' if isinstance(result, bytes)
+                         else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(routes=None):
+    """在后台线程启动服务器, 返回 (server, base_url)"""
+    handler = type(str('Handler'), (FakeWeChatHandler,), dict(routes=dict(routes or {})))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
@@ -9,7 +9,8 @@ setup(
     keywords=('weixin', 'weibo', 'api'),
     description='Python 2.x 3.x api for Weixin or Weibo platform',
     long_description='weixin or weibo platform python api for used',
-    install_requires=['requests>=2.0'],
+    install_requires=['requests>=2.0', 'futures>=3.0; python_version < "3"'],
+    extras_require={'async': ['aiohttp>=3.0'], 'crypto': ['cryptography>=2.0']},
 
     author='Yifei0727',
     author_email='Yifei0727@users.noreply.github.com',
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""测试共用: 将 `MPCenter` 的请求改写到本地模拟的微信接口服务器(benchmarks/fake_server.py)"""
+import threading
+
+_HOSTS = ('https://api.weixin.qq.com', 'http://file.api.weixin.qq.com', 'https://mp.weixin.qq.com')
+
+
+def local_url(base_url, url):
+    for host in _HOSTS:
+        if url.startswith(host):
+            return base_url + url[len(host):]
+    return url
+
+
+def redirect(center, base_url):
+    """改写 `center.session` 的 get/post, 返回 `center`"""
+    session = center.session
+    get, post = session.get, session.post
+    session.get = lambda url, *args, **kwargs: get(local_url(base_url, url), *args, **kwargs)
+    session.post = lambda url, *args, **kwargs: post(local_url(base_url, url), *args, **kwargs)
+    return center
+
+
+class Counter(object):
+    """线程安全的计数, 可记录同时进行中的最大数量"""
+
+    def __init__(self):
+        self.count = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.count += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._lock:
+            self.active -= 1
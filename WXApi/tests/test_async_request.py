@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""`AsyncMPCenter` 对本地模拟的微信接口服务器(benchmarks/fake_server.py)"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import aiohttp
+
+from fake_server import start_server
+from support import local_url
+from WXApi import (AsyncMPCenter, TextReply)
+from WXApi.WXError import (WXApiError, WeChatError)
+from WXApi.WXUtils import xml2event
+
+_TEXT = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+         '<FromUserName><![CDATA[openid1]]></FromUserName><CreateTime>1348831860</CreateTime>'
+         '<MsgType><![CDATA[text]]></MsgType><Content><![CDATA[hi]]></Content>'
+         '<MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+
+
+class _Session(object):
+    """将微信接口地址改写到模拟服务器的 `aiohttp.ClientSession`"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = aiohttp.ClientSession()
+
+    def get(self, url, **kwargs):
+        return self.session.get(local_url(self.base_url, url), **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(local_url(self.base_url, url), **kwargs)
+
+
+class AsyncMPCenterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = dict()
+        self.bodies = list()
+        self.lock = threading.Lock()
+        routes = {
+            '/cgi-bin/token': self.token,
+            '/cgi-bin/message/custom/send': self.custom_send,
+            '/cgi-bin/media/get': self.media_get,
+            '/cgi-bin/user/get': self.user_get,
+            '/cgi-bin/qrcode/create': lambda handler, query, body: dict(ticket='TICKET=', expire_seconds=60),
+            '/cgi-bin/showqrcode': lambda handler, query, body: dict(errcode=40001, errmsg='invalid'),
+        }
+        self.server, self.base_url = start_server(routes)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def token(self, handler, query, body):
+        self._count('token')
+        time.sleep(0.05)  # 使并发的协程都在刷新期间到达
+        return dict(access_token='TOKEN', expires_in=7200)
+
+    def custom_send(self, handler, query, body):
+        self.bodies.append((query['access_token'][0], json.loads(body.decode('utf-8'))))
+        if self.bodies[-1][1]['touser'] == 'blocked':
+            return dict(errcode=45015, errmsg='response out of time limit')
+        return dict(errcode=0, errmsg='ok')
+
+    def media_get(self, handler, query, body):
+        media_id = query['media_id'][0]
+        if media_id == 'video':
+            return dict(video_url='http://example.com/video.mp4')
+        if media_id == 'expired':
+            return dict(errcode=40007, errmsg='invalid media_id')
+        return b'\xff\xd8\xff' + media_id.encode('utf-8')
+
+    def user_get(self, handler, query, body):
+        if 'next_openid' not in query:
+            return dict(total=3, count=2, data=dict(openid=['o1', 'o2']), next_openid='o2')
+        return dict(total=3, count=1, data=dict(openid=['o3']), next_openid='o3')
+
+    def run_center(self, coro_func, **kwargs):
+        async def main():
+            session = _Session(self.base_url)
+            center = AsyncMPCenter('appid', 'secret', session=session, **kwargs)
+            try:
+                return await coro_func(center)
+            finally:
+                await center.close()
+                await session.session.close()
+
+        return asyncio.run(main())
+
+    def test_token_refreshed_once(self):
+        async def run(center):
+            return await asyncio.gather(*[center.get_access_token() for _ in range(20)])
+
+        self.assertEqual(self.run_center(run), ['TOKEN'] * 20)
+        self.assertEqual(self.calls['token'], 1)
+
+    def test_reply(self):
+        reply = TextReply(xml2event(_TEXT), 'hello')
+
+        async def run(center):
+            return (await center.reply(reply),
+                    await center.reply(dict(touser='openid2', msgtype='text', text=dict(content='x'))),
+                    await center.reply(dict(touser='blocked', msgtype='text', text=dict(content='x'))))
+
+        self.assertEqual(self.run_center(run, token='T', expires=time.time() + 1000), (True, True, None))
+        self.assertEqual(self.bodies[0], ('T', dict(touser='openid1', msgtype='text', text=dict(content='hello'))))
+        self.assertEqual(self.bodies[1][1]['touser'], 'openid2')
+
+    def test_download_media(self):
+        path = os.path.join(self.tmp, 'image.jpg')
+
+        async def run(center):
+            return await center.download_media('MEDIA', path)
+
+        self.assertIs(self.run_center(run, token='T', expires=time.time() + 1000), True)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'\xff\xd8\xffMEDIA')
+
+    def test_download_media_json(self):
+        video = os.path.join(self.tmp, 'video.mp4')
+        expired = os.path.join(self.tmp, 'expired.jpg')
+
+        async def run(center):
+            return await center.download_media('video', video), await center.download_media('expired', expired)
+
+        result = self.run_center(run, token='T', expires=time.time() + 1000)
+        self.assertEqual(result, (dict(video_url='http://example.com/video.mp4'), None))
+        self.assertFalse(os.path.exists(video))
+        self.assertFalse(os.path.exists(expired))
+
+    def test_download_media_exists(self):
+        path = os.path.join(self.tmp, 'image.jpg')
+        open(path, 'wb').close()
+
+        async def run(center):
+            return await center.download_media('MEDIA', path)
+
+        self.assertRaises(WXApiError, self.run_center, run, token='T', expires=time.time() + 1000)
+
+    def test_qrcode(self):
+        path = os.path.join(self.tmp, 'qrcode.jpg')
+
+        async def run(center):
+            url = await center.create_qrcode(1)
+            self.assertTrue(url.startswith('https://mp.weixin.qq.com/cgi-bin/showqrcode?ticket=TICKET'))
+            return await center.save_qrcode(path, url)
+
+        self.assertRaises(WeChatError, self.run_center, run, token='T', expires=time.time() + 1000)
+        self.assertFalse(os.path.exists(path))
+
+    def test_get_users(self):
+        async def run(center):
+            return await center.get_users()
+
+        self.assertEqual(self.run_center(run, token='T', expires=time.time() + 1000), ['o1', 'o2', 'o3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
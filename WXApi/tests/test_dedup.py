@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""回调消息去重: `message_key` 及 `MemoryDedupStore` / `FileDedupStore`"""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from WXApi import (FileDedupStore, MemoryDedupStore, message_key)
+from WXApi.WXUtils import (xml2event, xml2json)
+
+_HEAD = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+         '<FromUserName><![CDATA[openid1]]></FromUserName><CreateTime>1348831860</CreateTime>')
+TEXT = (_HEAD + '<MsgType><![CDATA[text]]></MsgType><Content><![CDATA[hi]]></Content>'
+        '<MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+BROKEN_TEXT = (_HEAD + '<MsgType><![CDATA[text]]></MsgType><MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+CLICK = (_HEAD + '<MsgType><![CDATA[event]]></MsgType><Event><![CDATA[CLICK]]></Event>'
+         '<EventKey><![CDATA[KEY]]></EventKey></xml>').encode('utf-8')
+
+
+class MessageKeyTest(unittest.TestCase):
+
+    def test_keys(self):
+        for lazy in (False, True):
+            self.assertEqual(message_key(xml2event(TEXT, lazy=lazy)), 'msg:1234567890123456')
+            self.assertEqual(message_key(xml2event(CLICK, lazy=lazy)), 'event:openid1:1348831860')
+        self.assertEqual(message_key(xml2json(TEXT)), 'msg:1234567890123456')
+        self.assertEqual(message_key(xml2json(CLICK)), 'event:openid1:1348831860')
+
+    def test_lazy_not_decoded(self):
+        msg = xml2event(BROKEN_TEXT, lazy=True)  # 缺少 Content, 解析时才会出错
+        self.assertEqual(message_key(msg), 'msg:1234567890123456')
+        self.assertEqual(object.__getattribute__(msg, '_msg')['MsgId'], '1234567890123456')  # 仍未解析
+        self.assertRaises(AttributeError, getattr, msg, 'content')
+
+        msg = xml2event(TEXT, lazy=True)
+        self.assertEqual(msg.content, 'hi')  # 已解析
+        self.assertEqual(message_key(msg), 'msg:1234567890123456')
+
+
+def _add_keys(path, keys, queue):
+    store = FileDedupStore(path, window=60, maxsize=1000)
+    queue.put([key for key in keys if store.add(key)])
+
+
+class DedupStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'dedup')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def stores(self, window=60, maxsize=1000):
+        return MemoryDedupStore(window, maxsize), FileDedupStore(self.path, window, maxsize)
+
+    def test_duplicate(self):
+        for store in self.stores():
+            self.assertFalse(store.is_duplicate(xml2event(TEXT, lazy=True)))
+            self.assertTrue(store.is_duplicate(xml2event(TEXT)))
+            self.assertTrue(store.is_duplicate(xml2json(TEXT)))
+            self.assertFalse(store.is_duplicate(xml2event(CLICK)))
+            self.assertTrue(store.is_duplicate(xml2event(CLICK, lazy=True)))
+
+    def test_window(self):
+        for store in self.stores(window=0.2):
+            self.assertTrue(store.add('a'))
+            self.assertFalse(store.add('a'))
+            time.sleep(0.3)
+            self.assertTrue(store.add('a'))
+
+    def test_file_shared(self):
+        first = FileDedupStore(self.path)
+        second = FileDedupStore(self.path)
+        self.assertTrue(first.add('a'))
+        self.assertFalse(second.add('a'))
+        first.close()
+        self.assertFalse(first.add('a'))  # 关闭后重新打开
+
+    def test_file_capacity(self):
+        store = FileDedupStore(self.path, maxsize=1000)
+        size = os.path.getsize(self.path)
+        keys = ['key%d' % i for i in range(1000)]
+        self.assertTrue(all(store.add(key) for key in keys))
+        self.assertFalse(any(store.add(key) for key in keys))
+        for i in range(5000):  # 过期前不增长
+            store.add('more%d' % i)
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_file_old_format(self):
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps({'a': time.time() + 60}).encode('utf-8'))
+        store = FileDedupStore(self.path)
+        self.assertTrue(store.add('a'))
+        self.assertFalse(store.add('a'))
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "需要 fork")
+    def test_file_across_processes(self):
+        FileDedupStore(self.path, maxsize=1000)
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        keys = ['key%d' % i for i in range(200)]
+        processes = [context.Process(target=_add_keys, args=(self.path, keys, queue)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        added = [key for _ in processes for key in queue.get(timeout=10)]
+        for process in processes:
+            process.join()
+        self.assertEqual(sorted(added), sorted(keys))  # 每个键只有一个进程记录成功
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""`MPCenter.download_media` / `save_qrcode` 对本地模拟的微信接口服务器"""
+import io
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+from fake_server import start_server
+from support import redirect
+from WXApi import MPCenter
+from WXApi.WXError import WXApiError
+
+
+def media_get(handler, query, body):
+    media_id = query['media_id'][0]
+    if media_id == 'video':
+        return dict(video_url='http://example.com/video.mp4')
+    if media_id == 'expired':
+        return dict(errcode=40007, errmsg='invalid media_id')
+    return b'\xff\xd8\xff' + media_id.encode('utf-8')
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        routes = {
+            '/cgi-bin/media/get': media_get,
+            '/cgi-bin/showqrcode': lambda handler, query, body: dict(url='http://weixin.qq.com/q/x'),
+        }
+        self.server, base_url = start_server(routes)
+        self.center = redirect(MPCenter('appid', 'secret', token='T', expires=time.time() + 1000), base_url)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.center.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def path(self, name, content=None):
+        path = os.path.join(self.tmp, name)
+        if content is not None:
+            with open(path, 'wb') as f:
+                f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download_media(self):
+        path = self.path('image.jpg')
+        self.assertIs(self.center.download_media('MEDIA', path), True)
+        self.assertEqual(self.read(path), b'\xff\xd8\xffMEDIA')
+        self.assertEqual(os.listdir(self.tmp), ['image.jpg'])
+
+    def test_file_mode_follows_umask(self):
+        umask = os.umask(0o022)
+        try:
+            path = self.path('image.jpg')
+            self.center.download_media('MEDIA', path)
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644)
+
+    def test_json_without_errcode(self):
+        path = self.path('video.mp4', b'old')
+        result = self.center.download_media('video', path, overwrite=True)
+        self.assertEqual(result, dict(video_url='http://example.com/video.mp4'))
+        self.assertEqual(self.read(path), b'old')  # 目标文件不被空文件替换
+        self.assertEqual(os.listdir(self.tmp), ['video.mp4'])
+
+        buffer = io.BytesIO()
+        self.assertEqual(self.center.download_media('video', buffer)['video_url'], 'http://example.com/video.mp4')
+        self.assertEqual(buffer.getvalue(), b'')
+
+    def test_error_json(self):
+        path = self.path('expired.jpg')
+        self.assertIsNone(self.center.download_media('expired', path))
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_exists(self):
+        path = self.path('image.jpg', b'old')
+        self.assertRaises(WXApiError, self.center.download_media, 'MEDIA', path)
+        self.assertEqual(self.read(path), b'old')
+
+    def test_save_qrcode_json(self):
+        path = self.path('qrcode.jpg')
+        self.assertRaises(WXApiError, self.center.save_qrcode, path,
+                          'https://mp.weixin.qq.com/cgi-bin/showqrcode?ticket=T')
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""`xml2event` 的延迟解析(lazy): 结果与立即解析一致, 包括未声明 __slots__ 的注册类"""
+import unittest
+
+from WXApi import (register_event_type, TextMsg)
+from WXApi.event import (_EVENT_TYPES, WeChatEvent)
+from WXApi.WXUtils import (xml2event, xml2json)
+
+_HEAD = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+         '<FromUserName><![CDATA[openid1]]></FromUserName><CreateTime>1348831860</CreateTime>')
+TEXT = (_HEAD + '<MsgType><![CDATA[text]]></MsgType><Content><![CDATA[hi]]></Content>'
+        '<MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+JOB_FINISH = (_HEAD + '<MsgType><![CDATA[event]]></MsgType><Event><![CDATA[TEMPLATESENDJOBFINISH]]></Event>'
+              '<MsgID>200163836</MsgID><Status><![CDATA[success]]></Status></xml>').encode('utf-8')
+JOB_BROKEN = (_HEAD + '<MsgType><![CDATA[event]]></MsgType>'
+              '<Event><![CDATA[TEMPLATESENDJOBFINISH]]></Event></xml>').encode('utf-8')
+
+
+class TemplateJobEvent(WeChatEvent):  # 未声明 __slots__, 字段存放在 __dict__ 中
+
+    def __init__(self, msg):
+        super(TemplateJobEvent, self).__init__(msg)
+        self.job_id = msg['MsgID']
+        self.status = msg['Status']
+
+
+class TaggedTextMsg(TextMsg):  # 内置消息类的子类, 同样未声明 __slots__
+
+    def __init__(self, msg):
+        super(TaggedTextMsg, self).__init__(msg)
+        self.tag = 'tagged:' + self.content
+
+
+class LazyDecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registered = dict(_EVENT_TYPES)
+        register_event_type('event', 'TEMPLATESENDJOBFINISH')(TemplateJobEvent)
+
+    def tearDown(self):
+        _EVENT_TYPES.clear()
+        _EVENT_TYPES.update(self.registered)
+
+    def test_registered_without_slots(self):
+        for lazy in (False, True):
+            event = xml2event(JOB_FINISH, lazy=lazy)
+            self.assertIsInstance(event, TemplateJobEvent)
+            self.assertEqual(event.status, 'success')
+            self.assertEqual(event.job_id, '200163836')
+            self.assertEqual(event.event, 'templatesendjobfinish')
+            self.assertEqual(event.from_id, 'openid1')
+
+    def test_registered_without_slots_broken(self):
+        event = xml2event(JOB_BROKEN, lazy=True)
+        for _ in range(2):  # 解析失败不改变对象, 每次访问都抛出 AttributeError
+            self.assertRaises(AttributeError, getattr, event, 'status')
+        self.assertEqual(event.from_id, 'openid1')
+
+    def test_text_subclass_without_slots(self):
+        msg = TaggedTextMsg.lazy(xml2json(TEXT))
+        self.assertEqual(msg.tag, 'tagged:hi')
+        self.assertEqual(msg.content, 'hi')
+        self.assertEqual(msg.message_id, '1234567890123456')
+
+        register_event_type('text')(TaggedTextMsg)
+        for lazy in (False, True):
+            msg = xml2event(TEXT, lazy=lazy)
+            self.assertIsInstance(msg, TaggedTextMsg)
+            self.assertEqual((msg.content, msg.tag), ('hi', 'tagged:hi'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""`MediaCache` 的持久化: 原子替换数据文件, 权限与新建文件一致"""
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from WXApi import MediaCache
+
+
+class MediaCacheFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'media.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_persisted(self):
+        cache = MediaCache(self.path)
+        cache.set('image', 'digest', 'MEDIA_ID')
+        self.assertEqual(MediaCache(self.path).get('image', 'digest')['media_id'], 'MEDIA_ID')
+        self.assertEqual(os.listdir(self.tmp), ['media.json'])  # 不留下临时文件
+
+    def test_file_mode_follows_umask(self):
+        umask = os.umask(0o022)
+        try:
+            MediaCache(self.path).set('image', 'digest', 'MEDIA_ID')
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""`MemoryTokenStore` / `FileTokenStore`: 多个 `MPCenter` 共用 access_token, 且只有一个刷新者"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from fake_server import start_server
+from support import (Counter, redirect)
+from WXApi import (MPCenter, MemoryTokenStore, FileTokenStore)
+
+
+class TokenStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.refreshes = Counter()
+        routes = {
+            '/cgi-bin/token': self.token,
+            '/cgi-bin/user/info': self.user_info,
+        }
+        self.server, self.base_url = start_server(routes)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def token(self, handler, query, body):
+        with self.refreshes as counter:
+            time.sleep(0.1)  # 使其他使用者都在刷新期间到达
+            return dict(access_token='TOKEN%d' % counter.count, expires_in=7200)
+
+    def user_info(self, handler, query, body):
+        if query['access_token'][0] == 'OLD':
+            return dict(errcode=40001, errmsg='invalid credential')
+        return dict(openid=query['openid'][0], nickname='nick')
+
+    def center(self, store):
+        return redirect(MPCenter('appid', 'secret', token_store=store), self.base_url)
+
+    def concurrent_tokens(self, store, number=8):
+        centers = [self.center(store) for _ in range(number)]
+        tokens = list()
+        threads = [threading.Thread(target=lambda c=c: tokens.append(c.access_token)) for c in centers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for center in centers:
+            center.close()
+        return tokens
+
+    def test_memory_single_refresher(self):
+        store = MemoryTokenStore()
+        self.assertEqual(self.concurrent_tokens(store), ['TOKEN1'] * 8)
+        self.assertEqual(self.refreshes.count, 1)
+        self.assertEqual(store.get('appid')[0], 'TOKEN1')
+
+    def test_file_single_refresher(self):
+        store = FileTokenStore(os.path.join(self.tmp, 'token.json'))
+        self.assertEqual(self.concurrent_tokens(store), ['TOKEN1'] * 8)
+        self.assertEqual(self.refreshes.count, 1)
+        self.assertEqual(FileTokenStore(store.path).get('appid')[0], 'TOKEN1')
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "需要 fork")
+    def test_file_single_refresher_across_processes(self):
+        path = os.path.join(self.tmp, 'token.json')
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+
+        def worker():
+            with self.center(FileTokenStore(path)) as center:
+                queue.put(center.access_token)
+
+        processes = [context.Process(target=worker) for _ in range(4)]
+        for process in processes:
+            process.start()
+        tokens = [queue.get(timeout=10) for _ in processes]
+        for process in processes:
+            process.join()
+        self.assertEqual(tokens, ['TOKEN1'] * 4)
+        self.assertEqual(self.refreshes.count, 1)
+
+    def test_adopt_stored_token(self):
+        for store in (MemoryTokenStore(), FileTokenStore(os.path.join(self.tmp, 'token.json'))):
+            expires = time.time() + 1000
+            store.set('appid', 'STORED', expires)
+            with self.center(store) as center:
+                self.assertEqual(center.access_token, 'STORED')
+                self.assertEqual(int(center.access_token_date.timestamp()), int(expires))
+        self.assertEqual(self.refreshes.count, 0)
+
+    def test_expired_stored_token(self):
+        store = MemoryTokenStore()
+        store.set('appid', 'EXPIRED', time.time() - 1)
+        with self.center(store) as center:
+            self.assertEqual(center.access_token, 'TOKEN1')
+        self.assertEqual(store.get('appid')[0], 'TOKEN1')
+
+    def test_stale_token_bypasses_store(self):
+        for store in (MemoryTokenStore(), FileTokenStore(os.path.join(self.tmp, 'token.json'))):
+            self.refreshes.count = 0
+            store.set('appid', 'OLD', time.time() + 1000)  # 仍未到期, 但微信已判定失效
+            first, second = self.center(store), self.center(store)
+            self.assertEqual(first.access_token, 'OLD')
+            self.assertEqual(second.access_token, 'OLD')
+            self.assertEqual(first.get_user_info('o1'), dict(openid='o1', nickname='nick'))
+            self.assertEqual(store.get('appid')[0], 'TOKEN1')
+            # 第二个实例遇到同一个失效的 access_token 时采用存储中已刷新的, 不再刷新
+            self.assertEqual(second.get_user_info('o2'), dict(openid='o2', nickname='nick'))
+            self.assertEqual(second.access_token, 'TOKEN1')
+            self.assertEqual(self.refreshes.count, 1)
+            self.assertEqual(first.retry_counts['token_expired'], 1)
+            first.close()
+            second.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""`MPCenter.iter_user_info` 对本地模拟的微信接口服务器"""
+import json
+import time
+import unittest
+
+from fake_server import start_server
+from support import (Counter, redirect)
+from WXApi import MPCenter
+
+
+class IterUserInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = Counter()
+        self.sizes = list()
+        self.server, base_url = start_server({'/cgi-bin/user/info/batchget': self.batchget})
+        self.center = redirect(MPCenter('appid', 'secret', token='T', expires=time.time() + 1000), base_url)
+
+    def tearDown(self):
+        self.center.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def batchget(self, handler, query, body):
+        user_list = json.loads(body.decode('utf-8'))['user_list']
+        with self.batches:
+            self.sizes.append(len(user_list))
+            time.sleep(0.02)
+            if user_list[0]['openid'] == 'o200':  # 第三批失败
+                return dict(errcode=40003, errmsg='invalid openid')
+            return dict(user_info_list=[dict(openid=user['openid'], language=user['lang']) for user in user_list])
+
+    def test_chunks(self):
+        openids = ['o%d' % i for i in range(250)]
+        results = list(self.center.iter_user_info(iter(openids), language='en', workers=2))
+        self.assertEqual(sorted(self.sizes), [50, 100, 100])
+        self.assertEqual(sorted(len(chunk) for chunk, infos, error in results), [50, 100, 100])
+        for chunk, infos, error in results:
+            if chunk[0] == 'o200':
+                continue
+            self.assertIsNone(error)
+            self.assertEqual([info['openid'] for info in infos], chunk)
+            self.assertEqual(set(info['language'] for info in infos), {'en'})
+
+    def test_error_isolated(self):
+        openids = ['o%d' % i for i in range(250)]
+        failed = [(chunk, infos, error) for chunk, infos, error in self.center.iter_user_info(openids)
+                  if error is not None]
+        self.assertEqual(len(failed), 1)
+        chunk, infos, error = failed[0]
+        self.assertEqual(chunk, ['o%d' % i for i in range(200, 250)])
+        self.assertIsNone(infos)
+        self.assertEqual(error.errorCode, 40003)
+
+    def test_bounded_in_flight(self):
+        workers = 2
+        consumed = list()
+
+        def openids():
+            for i in range(2000):
+                consumed.append(i)
+                yield 'u%d' % i
+
+        yielded = 0
+        for chunk, infos, error in self.center.iter_user_info(openids(), workers=workers):
+            # 已从 openids 读取(即已提交)而尚未产出的批次不超过 2 * workers
+            self.assertLessEqual(len(consumed) // 100 - yielded, 2 * workers)
+            yielded += 1
+        self.assertEqual(yielded, 20)
+        self.assertLessEqual(self.batches.max_active, workers)
+        self.assertEqual(self.batches.count, 20)
+
+
+class UserInfoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = list()
+        self.server, base_url = start_server({'/cgi-bin/user/info': self.user_info})
+        self.center = redirect(MPCenter('appid', 'secret', token='T', expires=time.time() + 1000,
+                                        user_cache_size=10), base_url)
+
+    def tearDown(self):
+        self.center.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def user_info(self, handler, query, body):
+        self.requests.append((query['openid'][0], query['lang'][0]))
+        return dict(openid=query['openid'][0], language=query['lang'][0], version=len(self.requests))
+
+    def stats(self):
+        stats = self.center.user_cache_stats()['user_info']
+        return stats['hits'], stats['misses']
+
+    def test_languages_cached_per_openid(self):
+        center = self.center
+        center.get_user_info('o1', 'zh_CN')
+        self.assertEqual(self.stats(), (0, 1))  # 每次请求只计一次
+        center.get_user_info('o1', 'en')  # 已缓存 zh_CN, en 仍是未命中
+        self.assertEqual(self.stats(), (0, 2))
+        center.get_user_info('o1', 'zh_HK')
+        for language in ('zh_CN', 'en', 'zh_HK'):
+            self.assertEqual(center.get_user_info('o1', language)['language'], language)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.stats(), (3, 3))
+        self.assertEqual(len(center.user_info_cache), 1)
+
+        center.invalidate_user('o1')  # 一次清除全部语言
+        self.assertEqual(len(center.user_info_cache), 0)
+        for language in ('zh_CN', 'en', 'zh_HK'):
+            self.assertEqual(center.get_user_info('o1', language)['version'], len(self.requests))
+        self.assertEqual(len(self.requests), 6)
+        self.assertEqual(self.stats(), (3, 6))
+
+    def test_language_expires_separately(self):
+        center = self.center
+        center.user_info_cache.ttl = 0.2
+        center.get_user_info('o1', 'zh_CN')
+        time.sleep(0.3)
+        center.get_user_info('o1', 'en')  # 写入 en 时不延长已过期的 zh_CN
+        center.get_user_info('o1', 'zh_CN')
+        center.get_user_info('o1', 'en')
+        self.assertEqual(self.requests, [('o1', 'zh_CN'), ('o1', 'en'), ('o1', 'zh_CN')])
+        self.assertEqual(self.stats(), (1, 3))  # 已过期的 zh_CN 计为未命中
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""`WebhookApp.handle`: 不合法的报文及去重存储出错时回复 "success", 不抛出异常"""
+import unittest
+from hashlib import sha1
+
+from WXApi import (WebhookApp, MemoryDedupStore, DedupStore, TextMsg, ClickEvent, SubEvent, TextReply,
+                   register_event_type)
+from WXApi.event import (_EVENT_TYPES, WeChatEvent)
+
+TOKEN = 'wechatrequest'
+TIMESTAMP = '1409304348'
+NONCE = '1500937196'
+QUERY = ('signature=%s&timestamp=%s&nonce=%s' % (
+    sha1(''.join(sorted([TOKEN, TIMESTAMP, NONCE])).encode('utf-8')).hexdigest(), TIMESTAMP, NONCE)).encode('utf-8')
+
+_HEAD = ('<xml><ToUserName><![CDATA[gh_123456789abc]]></ToUserName>'
+         '<FromUserName><![CDATA[openid1]]></FromUserName><CreateTime>1348831860</CreateTime>')
+TEXT = (_HEAD + '<MsgType><![CDATA[text]]></MsgType><Content><![CDATA[hi]]></Content>'
+        '<MsgId>1234567890123456</MsgId></xml>').encode('utf-8')
+CLICK = (_HEAD + '<MsgType><![CDATA[event]]></MsgType><Event><![CDATA[CLICK]]></Event>'
+         '<EventKey><![CDATA[KEY]]></EventKey></xml>').encode('utf-8')
+BROKEN = {
+    'click without EventKey': (_HEAD + '<MsgType><![CDATA[event]]></MsgType>'
+                               '<Event><![CDATA[CLICK]]></Event></xml>').encode('utf-8'),
+    'text without MsgId': (_HEAD + '<MsgType><![CDATA[text]]></MsgType>'
+                           '<Content><![CDATA[hi]]></Content></xml>').encode('utf-8'),
+    'subscribe without Ticket': (_HEAD + '<MsgType><![CDATA[event]]></MsgType><Event><![CDATA[subscribe]]></Event>'
+                                 '<EventKey><![CDATA[qrscene_123]]></EventKey></xml>').encode('utf-8'),
+    'not xml': b'<xml><ToUserName>',
+}
+JOB_FINISH = (_HEAD + '<MsgType><![CDATA[event]]></MsgType><Event><![CDATA[TEMPLATESENDJOBFINISH]]></Event>'
+              '<MsgID>200163836</MsgID><Status><![CDATA[success]]></Status></xml>').encode('utf-8')
+
+
+class TemplateJobEvent(WeChatEvent):  # 未声明 __slots__ 的自定义事件类
+
+    def __init__(self, msg):
+        super(TemplateJobEvent, self).__init__(msg)
+        self.status = msg['Status']
+
+
+class _BrokenDedup(DedupStore):
+
+    def add(self, key):
+        raise IOError("dedup backend down")
+
+
+class WebhookAppTest(unittest.TestCase):
+
+    def app(self, lazy, dedup):
+        app = WebhookApp(TOKEN, lazy=lazy, dedup=dedup)
+        self.handled = list()
+
+        def reply(msg):
+            self.handled.append(msg)
+            return TextReply(msg, msg.content if isinstance(msg, TextMsg) else msg.event_key)
+
+        for event_class in (TextMsg, ClickEvent, SubEvent):
+            app.register(event_class, reply)
+        return app
+
+    def cases(self):
+        for lazy in (True, False):
+            for dedup in (None, MemoryDedupStore):
+                yield lazy, dedup
+
+    def test_valid(self):
+        for lazy, dedup in self.cases():
+            app = self.app(lazy, dedup and dedup())
+            status, data = app.handle('POST', QUERY, TEXT)
+            self.assertEqual(status, 200)
+            self.assertIn(b'<![CDATA[hi]]>', data)
+            self.assertIn(b'<![CDATA[KEY]]>', app.handle('POST', QUERY, CLICK)[1])
+            if dedup is not None:
+                self.assertEqual(app.handle('POST', QUERY, TEXT), (200, b'success'))
+                self.assertEqual(len(self.handled), 2)
+
+    def test_broken_messages(self):
+        for lazy, dedup in self.cases():
+            app = self.app(lazy, dedup and dedup())
+            for name, body in BROKEN.items():
+                self.assertEqual(app.handle('POST', QUERY, body), (200, b'success'),
+                                 "%s lazy=%s dedup=%s" % (name, lazy, dedup))
+            if not lazy:
+                self.assertEqual(self.handled, [])  # 解析失败, 不调用处理函数
+
+    def test_dedup_error(self):
+        for lazy in (True, False):
+            app = self.app(lazy, _BrokenDedup())
+            self.assertEqual(app.handle('POST', QUERY, TEXT), (200, b'success'))
+            self.assertEqual(app.handle('POST', QUERY, BROKEN['click without EventKey']), (200, b'success'))
+            self.assertEqual(self.handled, [])
+
+    def test_custom_event_class(self):
+        registered = dict(_EVENT_TYPES)
+        register_event_type('event', 'TEMPLATESENDJOBFINISH')(TemplateJobEvent)
+        try:
+            for lazy, dedup in self.cases():
+                app = WebhookApp(TOKEN, lazy=lazy, dedup=dedup and dedup())
+                statuses = list()
+
+                @app.register(TemplateJobEvent)
+                def job_finished(event):
+                    statuses.append(event.status)
+                    return TextReply(event, 'ok')
+
+                status, data = app.handle('POST', QUERY, JOB_FINISH)
+                self.assertEqual(status, 200)
+                self.assertIn(b'<![CDATA[ok]]>', data)
+                self.assertEqual(statuses, ['success'], "lazy=%s dedup=%s" % (lazy, dedup))
+        finally:
+            _EVENT_TYPES.clear()
+            _EVENT_TYPES.update(registered)
+
+    def test_signature(self):
+        app = self.app(True, None)
+        self.assertEqual(app.handle('POST', QUERY.replace(b'signature=', b'signature=0'), TEXT), (401, b''))
+        self.assertEqual(app.handle('GET', QUERY + b'&echostr=abc', b''), (200, b'abc'))
+
+
+if __name__ == '__main__':
+    unittest.main()